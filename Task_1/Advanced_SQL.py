@@ -9,6 +9,14 @@ The database loan.db consists of 5 tables:
 You are required to make use of your knowledge in SQL to query the database object (saved as loan.db) and return the requested information.
 Simply fill in the vacant space wrapped in triple quotes per question (each function represents a question)
 
+The loader also builds deduplicated, trimmed `customers_clean` and `credit_clean` tables keyed on CustomerID,
+with a normalized `ProvinceCode` column in `customers_clean`. The queries below join against these instead of
+re-aggregating the raw tables. The `repayments` table carries precomputed `RepaymentDateGMT`, `RepaymentMonth`
+and `RepaymentHourGMT` columns, and `repayment_summary` holds the 6am to 6pm GMT repayments per customer per month,
+updated with deltas on incremental loads. The `repayment_pivot` view gives the same wide layout as question_5 straight
+from the summary, for reports that do not need the `timeline` table. Call 'prepare_database()' once before running
+the questions, so a loan.db without these tables gets them.
+
 NOTE:
 The database will be reset when grading each section. Any changes made to the database in the previous `SQL` section can be ignored.
 Each question in this section is isolated unless it is stated that questions are linked.
@@ -16,6 +24,20 @@ Remember to clean your data
 
 """
 
+import duckdb
+
+from database.database_load import database_path, refresh_derived_tables
+
+
+def prepare_database(database=database_path):
+    """
+    Build the derived tables the questions read if loan.db does not have them, e.g. a loan.db from an older loader.
+    Tables that already exist are kept, so calling it again is cheap.
+    """
+
+    with duckdb.connect(database) as cursor:
+        refresh_derived_tables(cursor)
+
 
 def question_1():
     """
@@ -23,20 +45,6 @@ def question_1():
     """
 
     qry = """
-        WITH customers_clean AS (
-            SELECT
-                CustomerID,
-                MIN(Income) AS Income
-            FROM customers
-            GROUP BY CustomerID
-        ),
-        credit_clean AS (
-            SELECT
-                CustomerID,
-                MIN(CustomerClass) AS CustomerClass
-            FROM credit
-            GROUP BY CustomerID
-        )
         SELECT
             cr.CustomerClass,
             AVG(cu.Income) AS AverageIncome
@@ -56,27 +64,9 @@ def question_2():
     """
 
     qry = """
-        WITH customers_clean AS (
-            SELECT
-                CustomerID,
-                MIN(TRIM(Region)) AS Region
-            FROM customers
-            GROUP BY CustomerID
-        )
         SELECT
             COUNT(*) AS RejectedApplications,
-            CASE
-                WHEN c.Region = 'WesternCape'   THEN 'WC'
-                WHEN c.Region = 'Gauteng'       THEN 'GT'
-                WHEN c.Region = 'KwaZulu-Natal' THEN 'KZN'
-                WHEN c.Region = 'EasternCape'   THEN 'EC'
-                WHEN c.Region = 'FreeState'     THEN 'FS'
-                WHEN c.Region = 'Limpopo'       THEN 'LP'
-                WHEN c.Region = 'NorthWest'     THEN 'NW'
-                WHEN c.Region = 'NorthernCape'  THEN 'NC'
-                WHEN c.Region = 'Mpumalanga'    THEN 'MP'
-                ELSE c.Region
-            END AS Province
+            c.ProvinceCode AS Province
         FROM loans l
         JOIN customers_clean c
             ON l.CustomerID = c.CustomerID
@@ -109,20 +99,6 @@ def question_3():
             CreditScore INTEGER
         );
 
-        WITH customers_clean AS (
-            SELECT
-                CustomerID,
-                MIN(Income) AS Income
-            FROM customers
-            GROUP BY CustomerID
-        ),
-        credit_clean AS (
-            SELECT
-                CustomerID,
-                MIN(CreditScore) AS CreditScore
-            FROM credit
-            GROUP BY CustomerID
-        )
         INSERT INTO financing (
             CustomerID, Income, LoanAmount, LoanTerm, InterestRate, ApprovalStatus, CreditScore
         )
@@ -157,8 +133,9 @@ def question_4():
     Hint: there should be 12x CustomerID = 1.
     """
 
-    # London time is assumed to be GMT and timezone abbreviations are treated as fixed offsets.
-    # Daylight saving time is ignored.
+    # London time is assumed to be GMT. The loader converts every repayment to GMT with the `timezones` table
+    # (fixed offsets, daylight saving is ignored) and keeps `repayment_summary` up to date with the number and total
+    # of the 6am to 6pm repayments per customer-month, so `repayments` itself is not scanned here.
 
     qry = """
         DROP TABLE IF EXISTS timeline;
@@ -167,39 +144,17 @@ def question_4():
         WITH customer_ids AS (
             SELECT DISTINCT CustomerID
             FROM customers
-        ),
-        repayments_gmt AS (
-            SELECT
-                RepaymentID,
-                CustomerID,
-                Amount,
-                CASE TimeZone
-                    WHEN 'UTC' THEN RepaymentDate
-                    WHEN 'GMT' THEN RepaymentDate
-                    WHEN 'CET' THEN RepaymentDate - INTERVAL '1 hour'
-                    WHEN 'EET' THEN RepaymentDate - INTERVAL '2 hours'
-                    WHEN 'IST' THEN RepaymentDate - INTERVAL '5 hours 30 minutes'
-                    WHEN 'JST' THEN RepaymentDate - INTERVAL '9 hours'
-                    WHEN 'PST' THEN RepaymentDate + INTERVAL '8 hours'
-                    WHEN 'PNT' THEN RepaymentDate + INTERVAL '7 hours'
-                    WHEN 'CST' THEN RepaymentDate + INTERVAL '6 hours'
-                    ELSE RepaymentDate
-                END AS RepaymentDateGMT
-            FROM repayments
         )
         SELECT
             c.CustomerID,
             m.MonthName,
-            COUNT(r.RepaymentID) AS NumberOfRepayments,
-            COALESCE(SUM(r.Amount), 0) AS AmountTotal
+            COALESCE(s.NumberOfRepayments, 0) AS NumberOfRepayments,
+            COALESCE(s.AmountTotal, 0) AS AmountTotal
         FROM customer_ids c
         CROSS JOIN months m
-        LEFT JOIN repayments_gmt r
-            ON r.CustomerID = c.CustomerID
-        AND CAST(STRFTIME('%m', r.RepaymentDateGMT) AS INTEGER) = m.MonthID
-        AND STRFTIME('%H:%M:%S', r.RepaymentDateGMT) >= '06:00:00'
-        AND STRFTIME('%H:%M:%S', r.RepaymentDateGMT) <  '18:00:00'
-        GROUP BY c.CustomerID, m.MonthID, m.MonthName
+        LEFT JOIN repayment_summary s
+            ON s.CustomerID = c.CustomerID
+        AND s.MonthID = m.MonthID
         ORDER BY c.CustomerID, m.MonthID;
     """
 
@@ -283,15 +238,7 @@ def question_6():
         DROP TABLE IF EXISTS corrected_customers;
 
         CREATE TABLE corrected_customers AS
-        WITH customers_clean AS (
-            SELECT
-                CustomerID,
-                MIN(Age) AS Age,
-                Gender
-            FROM customers
-            GROUP BY CustomerID, Gender
-        ),
-        base AS (
+        WITH base AS (
             SELECT
                 CustomerID,
                 Age,
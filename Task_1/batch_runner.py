@@ -0,0 +1,165 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import duckdb
+
+import Advanced_SQL as asql
+import SQL as sql
+from database.database_load import database_path, dependent_tables, refresh_derived_tables
+from query_cache import default_cache, normalize_sql, run_query, split_statements, written_tables
+
+"""
+Batch runner for the `question_*` functions in SQL.py and Advanced_SQL.py.
+
+'run_questions()' runs every question against one loan.db connection. Read-only queries run concurrently on a pool of
+DuckDB cursors, one per worker thread. Queries that write (`UPDATE`, `CREATE TABLE`, `DROP`, ...) run one at a time in
+the order they are declared, and only once the queries before them that read the tables they write have finished.
+Queries that read a table wait for the earlier queries that write it, so Advanced_SQL.question_5 runs after question_4
+and question_7 after question_6. Writing a table also writes the derived tables built from it, so
+Advanced_SQL.question_1 reads `credit_clean` after SQL.question_5 has updated `credit`.
+
+The writing questions change loan.db like they do in the notebook, e.g. SQL.question_5 updates `credit`. Reset the
+database with 'database/database_load.py' to undo them.
+
+"""
+
+QUESTION_MODULES = (sql, asql)
+
+
+def discover_questions(modules=QUESTION_MODULES):
+    """
+    Find the `question_*` functions of the question modules.
+
+    Args:
+        modules (tuple): Modules to search, SQL and Advanced_SQL by default
+
+    Returns:
+        list: (name, function) pairs such as ("SQL.question_1", sql.question_1), in module and question order.
+
+    """
+
+    questions = []
+    for module in modules:
+        numbers = sorted(
+            int(name.split("_", 1)[1])
+            for name in vars(module)
+            if name.startswith("question_") and name.split("_", 1)[1].isdigit()
+        )
+        questions.extend(
+            (f"{module.__name__}.question_{number}", getattr(module, f"question_{number}")) for number in numbers
+        )
+    return questions
+
+
+def plan_questions(cursor, questions):
+    """
+    Work out which tables every question reads and writes, and which earlier questions it has to wait for.
+
+    Args:
+        cursor (DuckDBPyConnection): Connection to loan.db, used to resolve the tables of read-only queries
+        questions (list): (name, function) pairs from 'discover_questions()'
+
+    Returns:
+        list: One dict per question with `name`, `qry`, `reads`, `writes` (None for read-only queries)
+            and `depends_on`, the names of the questions that have to finish first.
+
+    """
+
+    plan = []
+    for name, question in questions:
+        qry = question()
+        statements = split_statements(normalize_sql(qry))
+        writes = written_tables(statements)
+        reads = set()
+        if writes is None:
+            reads = set().union(*(cursor.get_table_names(statement) for statement in statements))
+        else:
+            # Writing a table also rewrites the derived tables built from it, e.g. credit_clean from credit
+            writes = writes + dependent_tables(writes)
+
+        depends_on = []
+        for earlier in plan:
+            if writes is not None and earlier["writes"] is not None:
+                # Writes run one at a time, in the order they are declared
+                depends_on.append(earlier["name"])
+            elif writes is not None and reads.union(writes).intersection(earlier["reads"]):
+                depends_on.append(earlier["name"])
+            elif earlier["writes"] is not None and reads.intersection(earlier["writes"]):
+                depends_on.append(earlier["name"])
+
+        plan.append({"name": name, "qry": qry, "reads": reads, "writes": writes, "depends_on": depends_on})
+
+    return plan
+
+
+def run_questions(questions=None, database=database_path, n_workers=None, cache=default_cache, as_arrow=False):
+    """
+    Run question queries concurrently where they are independent, and in dependency order where they are not.
+
+    Args:
+        questions (list): (name, function) pairs, all questions of SQL.py and Advanced_SQL.py by default
+        database (str): DuckDB database file
+        n_workers (int): Number of worker threads and cursors, defaults to the number of CPUs
+        cache (QueryCache): Result cache of 'query_cache.run_query()', None to always execute the queries
+        as_arrow (bool): Return Arrow tables instead of pandas Dataframes
+
+    Returns:
+        dict: The result set of every question, by name, in the order of the questions.
+
+    """
+
+    questions = discover_questions() if questions is None else questions
+    n_workers = n_workers or os.cpu_count() or 1
+
+    connection = duckdb.connect(database)
+    cursors = []
+    local = threading.local()
+
+    def execute(task):
+        # Every worker thread gets its own cursor on the shared connection
+        if not hasattr(local, "cursor"):
+            local.cursor = connection.cursor()
+            cursors.append(local.cursor)
+        result = run_query(task["qry"], local.cursor, cache)
+        # DuckDB converts its own Arrow results to the same pandas dtypes as DuckDBPyConnection.df()
+        return result if as_arrow else local.cursor.from_arrow(result).df()
+
+    try:
+        # Build derived tables missing from a loan.db made by an older loader before resolving what the questions read
+        refresh_derived_tables(connection)
+        plan = plan_questions(connection, questions)
+        pending = {task["name"]: task for task in plan}
+        results = {}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            while pending or running:
+                for name, task in list(pending.items()):
+                    if all(dependency in results for dependency in task["depends_on"]):
+                        running[pool.submit(execute, task)] = name
+                        del pending[name]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+    finally:
+        for cursor in cursors:
+            cursor.close()
+        connection.close()
+
+    return {task["name"]: results[task["name"]] for task in plan}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run every question of SQL.py and Advanced_SQL.py against loan.db")
+    parser.add_argument("--workers", type=int, help="number of worker threads, defaults to the number of CPUs")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_questions(n_workers=args.workers, as_arrow=True)
+    for name, result in results.items():
+        print(f"{name:26}{result.num_rows:>8} rows")
+    print(f"{len(results)} questions in {time.perf_counter() - start:.2f}s")
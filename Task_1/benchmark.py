@@ -0,0 +1,332 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import time
+from datetime import datetime, timezone
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from batch_runner import discover_questions
+from database.database_load import PROVINCE_CODES, data_file_path, full_load
+from query_cache import normalize_sql, run_query, split_statements, written_tables
+
+"""
+Benchmark suite for the Task_1 queries.
+
+'generate_dataset()' writes seeded files shaped like the ones in 'database/data' at any scale, up to 10^8 repayments.
+They keep the anomalies of the sample files that the queries have to clean up: customers listed twice in the
+customer, loan and credit files, region names that are spelled out instead of abbreviated, and repayments recorded in
+mixed time zones. Strings are also padded with spaces at a configurable rate. Repayments are written in chunks to a
+directory of CSV files, so memory use does not grow with the number of repayments.
+
+'run_benchmark()' loads the generated files through 'database/database_load.py' and times every `question_*` query
+of SQL.py and Advanced_SQL.py through 'query_cache.run_query()' without a cache, so the derived tables are refreshed
+after a writing question. Only read-only questions are run more than once. Run
+'python benchmark.py --customers 100000 --repayments 10000000 --output results.json' to write machine-readable results
+that can be compared between versions.
+
+"""
+
+benchmark_dir = data_file_path("benchmark")
+
+# Written into every generated directory, which is only emptied again by 'generate_dataset()' when it has this file
+MARKER_FILE = ".generated_by_benchmark"
+
+# Shares seen in the sample files: 14 of 1000 customers are duplicated, 57 of 1014 regions are spelled out
+DUPLICATE_RATE = 0.014
+FULL_REGION_RATE = 0.056
+PADDED_RATE = 0.01
+
+LOAN_TERMS = np.array([12, 24, 36, 48, 60])
+REGION_NAMES = {code: name for name, code in PROVINCE_CODES.items()}
+REGION_CODES = np.array(sorted(REGION_NAMES))
+
+# Time zones in the repayments file and their number of rows in the sample
+TIMEZONE_COUNTS = {
+    "JST": 857,
+    "PST": 833,
+    "CET": 801,
+    "PNT": 443,
+    "UTC": 435,
+    "EET": 425,
+    "GMT": 408,
+    "IST": 406,
+    "CST": 392,
+}
+
+YEAR_START = np.datetime64("2024-01-01T00:00:00", "us")
+DAYS_IN_YEAR = 366
+MICROSECONDS_PER_DAY = 86_400 * 10**6
+
+
+def _pad(rng, values, padded_rate):
+    """
+    Surround a random share of string values with spaces.
+    """
+
+    values = values.astype(object)
+    padded = rng.random(len(values)) < padded_rate
+    left = rng.integers(0, 3, size=len(values))
+    right = rng.integers(1, 3, size=len(values))
+    values[padded] = [" " * l + v + " " * r for v, l, r in zip(values[padded], left[padded], right[padded])]
+    return values
+
+
+def _with_duplicates(rng, df, duplicate_ids):
+    """
+    Repeat the rows of the duplicated customers at random later positions, like the sample files.
+    """
+
+    positions = np.arange(len(df), dtype=float)
+    duplicates = df[df["CustomerID"].isin(duplicate_ids)]
+    duplicate_positions = rng.uniform(duplicates.index.to_numpy(), len(df))
+    df = pd.concat([df, duplicates], ignore_index=True)
+    order = np.argsort(np.r_[positions, duplicate_positions], kind="mergesort")
+    return df.iloc[order].reset_index(drop=True)
+
+
+def _write_csv(df, path):
+    # The sample files have Windows line endings
+    df.to_csv(path, index=False, lineterminator="\r\n")
+
+
+def generate_dataset(
+    output_dir=benchmark_dir,
+    n_customers=1_000,
+    n_repayments=5_000,
+    seed=0,
+    duplicate_rate=DUPLICATE_RATE,
+    full_region_rate=FULL_REGION_RATE,
+    padded_rate=PADDED_RATE,
+    chunk_size=5_000_000,
+):
+    """
+    Generate a seeded synthetic dataset for the Task_1 schema.
+
+    Args:
+        output_dir (str): Directory to write the files to. It must be empty or missing, or a directory generated
+            before, which is emptied first
+        n_customers (int): Number of distinct customers, every customer has one loan and one credit record
+        n_repayments (int): Number of repayments
+        seed (int): Seed of the random generator, the same seed and chunk_size always give the same files
+        duplicate_rate (float): Share of customers listed twice in the customer, loan and credit files
+        full_region_rate (float): Share of customers whose region is spelled out, e.g. 'Gauteng' instead of 'GT'
+        padded_rate (float): Share of string values padded with spaces
+        chunk_size (int): Number of repayments per file in the 'repayments' directory
+
+    Returns:
+        dict: Table name to the file or directory to load it from, for 'database_load.full_load(sources=...)'.
+
+    Raises:
+        FileExistsError: If output_dir has files and was not generated by this function.
+
+    """
+
+    seed_sequence = np.random.SeedSequence(seed)
+    customer_seed, repayment_seed = seed_sequence.spawn(2)
+    rng = np.random.default_rng(customer_seed)
+
+    if os.path.exists(output_dir) and os.listdir(output_dir):
+        if not os.path.exists(os.path.join(output_dir, MARKER_FILE)):
+            raise FileExistsError(f"{output_dir} is not empty and was not generated by the benchmark, not removing it")
+        shutil.rmtree(output_dir)
+    os.makedirs(os.path.join(output_dir, "repayments"))
+    open(os.path.join(output_dir, MARKER_FILE), "w").close()
+
+    # Names are drawn from the names in the sample customer file
+    df_sample = pd.read_csv(data_file_path("customer_data.csv"))
+    customer_ids = np.arange(1, n_customers + 1)
+    duplicate_ids = customer_ids[rng.random(n_customers) < duplicate_rate]
+
+    regions = rng.choice(REGION_CODES, size=n_customers)
+    spelled_out = rng.random(n_customers) < full_region_rate
+    regions = np.where(spelled_out, [REGION_NAMES[code] for code in regions], regions)
+
+    df_customers = pd.DataFrame(
+        {
+            "CustomerID": customer_ids,
+            "Name": _pad(rng, rng.choice(df_sample["Name"].unique(), size=n_customers), padded_rate),
+            "Surname": _pad(rng, rng.choice(df_sample["Surname"].unique(), size=n_customers), padded_rate),
+            "Age": rng.integers(18, 81, size=n_customers),
+            "Gender": _pad(rng, rng.choice(np.array(["Male", "Female"]), size=n_customers), padded_rate),
+            "Income": rng.integers(40_000, 90_000, size=n_customers),
+            "Region": _pad(rng, regions, padded_rate),
+        }
+    )
+
+    df_loans = pd.DataFrame(
+        {
+            "CustomerID": customer_ids,
+            "LoanAmount": rng.integers(8_000, 30_000, size=n_customers),
+            "LoanTerm": rng.choice(LOAN_TERMS, size=n_customers),
+            "InterestRate": np.round(rng.uniform(4.0, 8.5, size=n_customers), 2),
+            "ApprovalStatus": _pad(
+                rng, np.where(rng.random(n_customers) < 0.485, "Approved", "Rejected"), padded_rate
+            ),
+        }
+    )
+
+    # Customer classes follow the credit score: B below 700, A below 800 and A+ at 800
+    credit_scores = rng.integers(600, 801, size=n_customers)
+    customer_classes = np.select([credit_scores >= 800, credit_scores >= 700], ["A+", "A"], "B")
+    df_credit = pd.DataFrame(
+        {
+            "CustomerID": customer_ids,
+            "CreditScore": credit_scores,
+            "CustomerClass": _pad(rng, customer_classes, padded_rate),
+        }
+    )
+
+    sources = {
+        "customers": os.path.join(output_dir, "customer_data.csv"),
+        "loans": os.path.join(output_dir, "loan_dataset.csv"),
+        "credit": os.path.join(output_dir, "credit_data.csv"),
+        "repayments": os.path.join(output_dir, "repayments"),
+    }
+    _write_csv(_with_duplicates(rng, df_customers, duplicate_ids), sources["customers"])
+    _write_csv(_with_duplicates(rng, df_loans, duplicate_ids), sources["loans"])
+    _write_csv(_with_duplicates(rng, df_credit, duplicate_ids), sources["credit"])
+
+    # Repayments are ordered by day with random times of day, each chunk covering the next stretch of the year
+    timezones = np.array(list(TIMEZONE_COUNTS))
+    timezone_weights = np.array(list(TIMEZONE_COUNTS.values())) / sum(TIMEZONE_COUNTS.values())
+    n_chunks = max(1, -(-n_repayments // chunk_size))
+    chunk_bounds = np.linspace(0, n_repayments, n_chunks + 1).astype(np.int64)
+
+    for chunk, (chunk_rng, start, stop) in enumerate(
+        zip(map(np.random.default_rng, repayment_seed.spawn(n_chunks)), chunk_bounds[:-1], chunk_bounds[1:])
+    ):
+        n_rows = stop - start
+        first_day = start * DAYS_IN_YEAR // max(n_repayments, 1)
+        last_day = max(first_day + 1, stop * DAYS_IN_YEAR // max(n_repayments, 1))
+        days = np.sort(chunk_rng.integers(first_day, last_day, size=n_rows))
+        offsets = days * MICROSECONDS_PER_DAY + chunk_rng.integers(0, MICROSECONDS_PER_DAY, size=n_rows)
+
+        df_repayments = pd.DataFrame(
+            {
+                "RepaymentID": np.arange(start + 1, stop + 1),
+                "RepaymentDate": np.datetime_as_string(YEAR_START + offsets.astype("timedelta64[us]"), unit="us"),
+                "Amount": chunk_rng.uniform(5.0, 500.0, size=n_rows),
+                "CustomerID": chunk_rng.integers(1, n_customers + 1, size=n_rows),
+                "TimeZone": chunk_rng.choice(timezones, size=n_rows, p=timezone_weights),
+            }
+        )
+        _write_csv(df_repayments, os.path.join(sources["repayments"], f"Loan_Repayments_{chunk:04d}.csv"))
+
+    return sources
+
+
+def run_benchmark(
+    n_customers,
+    n_repayments,
+    seed=0,
+    repeat=3,
+    output_dir=benchmark_dir,
+    questions=None,
+    chunk_size=5_000_000,
+):
+    """
+    Generate a dataset, load it with 'database_load.full_load()' and time every question query.
+
+    Args:
+        n_customers (int): Number of customers to generate
+        n_repayments (int): Number of repayments to generate
+        seed (int): Seed of the generator
+        repeat (int): Number of runs per read-only query, the fastest one is kept. Writing queries run once.
+        output_dir (str): Directory for the generated files and the benchmark loan.db
+        questions (list): (name, function) pairs, all questions of SQL.py and Advanced_SQL.py by default
+        chunk_size (int): Number of repayments per generated file
+
+    Returns:
+        list: One dict per stage with `stage`, `seconds`, `rows`, `n_customers` and `n_repayments`.
+            Stages are 'generate', 'load' and one per question, run in the order they are declared.
+
+    """
+
+    start = time.perf_counter()
+    sources = generate_dataset(output_dir, n_customers, n_repayments, seed, chunk_size=chunk_size)
+    results = [{"stage": "generate", "seconds": time.perf_counter() - start, "rows": n_repayments}]
+
+    database = os.path.join(output_dir, "loan.db")
+    start = time.perf_counter()
+    summary = full_load(database, sources)
+    results.append(
+        {"stage": "load", "seconds": time.perf_counter() - start, "rows": sum(row["rows"] for row in summary)}
+    )
+
+    questions = discover_questions() if questions is None else questions
+    with duckdb.connect(database) as cursor:
+        for name, question in questions:
+            qry = question()
+            timings = []
+            for _ in range(repeat if written_tables(split_statements(normalize_sql(qry))) is None else 1):
+                start = time.perf_counter()
+                rows = run_query(qry, cursor, cache=None).num_rows
+                timings.append(time.perf_counter() - start)
+            results.append({"stage": name, "seconds": min(timings), "rows": rows})
+
+    for result in results:
+        result.update({"n_customers": n_customers, "n_repayments": n_repayments})
+
+    return results
+
+
+def write_results(results, path):
+    """
+    Write benchmark results with environment metadata to a JSON file.
+
+    Args:
+        results (list): Records from 'run_benchmark()'
+        path (str): Output JSON file
+
+    """
+
+    payload = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "duckdb": duckdb.__version__,
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Task_1 queries on synthetic data.")
+    parser.add_argument("--customers", type=int, nargs="+", default=[10_000], help="numbers of customers")
+    parser.add_argument("--repayments", type=int, nargs="+", default=[1_000_000], help="numbers of repayments")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generator")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per read-only query, the fastest is kept")
+    parser.add_argument("--chunk-size", type=int, default=5_000_000, help="repayments per generated file")
+    parser.add_argument(
+        "--data-dir",
+        default=benchmark_dir,
+        help="directory for the generated files and loan.db, must be empty or generated by an earlier run",
+    )
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args()
+    if len(args.customers) != len(args.repayments):
+        parser.error("--customers and --repayments need the same number of sizes")
+
+    results = []
+    for n_customers, n_repayments in zip(args.customers, args.repayments):
+        results.extend(
+            run_benchmark(
+                n_customers,
+                n_repayments,
+                seed=args.seed,
+                repeat=args.repeat,
+                output_dir=args.data_dir,
+                chunk_size=args.chunk_size,
+            )
+        )
+
+    print(pd.DataFrame(results).to_string(index=False))
+    if args.output:
+        write_results(results, args.output)
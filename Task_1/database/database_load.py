@@ -1,89 +1,755 @@
-import duckdb
-import os
-import subprocess
-
-# Delete the existing loan.db if it exists
-database_path = os.path.join(os.path.dirname(__file__), 'loan.db')
-if os.path.exists(database_path):
-    os.remove(database_path)
-cursor = duckdb.connect(database_path)
-
-
- 
-def data_file_path(filename):
-    "function to get correct path to data files"
-    data_dir = os.path.join(os.path.dirname(__file__),'data')
-    return os.path.join(data_dir, filename)
-
-
-
-
-loan_qry = """CREATE TABLE loans AS SELECT * FROM read_csv(?, header=True, columns = {
-               'CustomerID':'INTEGER',
-               'LoanAmount':'INTEGER',
-               'LoanTerm':'INTEGER',
-               'InterestRate':'FLOAT',
-               'ApprovalStatus':'STRING'
-               })"""
-
-cursor.execute(loan_qry, [data_file_path('loan_dataset.csv')])
-
-
-
-
-
-customer_qry = """CREATE TABLE customers AS SELECT * FROM read_csv(?, header=True, columns = {
-               'CustomerID':'INTEGER',
-               'Name':'STRING',
-               'Surname':'STRING',
-               'Age':'INTEGER',
-               'Gender':'STRING',
-               'Income':'INTEGER',
-               'Region':'STRING'
-               })"""
-
-cursor.execute(customer_qry, [data_file_path('customer_data.csv')])
-
-
-
-
-credit_qry = """CREATE TABLE credit AS SELECT * FROM read_csv(?, header=True, columns = {
-               'CustomerID':'INTEGER',
-               'CreditScore':'INTEGER',
-               'CustomerClass':'STRING'
-               })"""
-
-cursor.execute(credit_qry, [data_file_path('credit_data.csv')])
-
-
-
-
-repayment_qry = """CREATE TABLE repayments AS SELECT * FROM read_csv(?, header=True, columns = {
-               'RepaymentID':'INTEGER',
-               'RepaymentDate':'TIMESTAMP',
-               'Amount':'INTEGER',
-               'CustomerID':'INTEGER',
-               'TimeZone' : 'String'
-               })"""
-
-cursor.execute(repayment_qry, [data_file_path('Loan_Repayments.csv')])
-
-
-
-
-months_qry = """CREATE TABLE months AS SELECT * FROM read_csv(?, header=True, columns = {
-               'MonthID':'INTEGER',
-               'MonthName':'STRING',
-               })"""
-
-cursor.execute(months_qry, [data_file_path('Months.csv')])
-
-
-
-
-cursor.close()
-
-
-
-
-
+import argparse
+import calendar
+import duckdb
+import glob
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+database_path = os.path.join(os.path.dirname(__file__), 'loan.db')
+
+
+def data_file_path(filename):
+    "function to get correct path to data files"
+    data_dir = os.path.join(os.path.dirname(__file__),'data')
+    return os.path.join(data_dir, filename)
+
+
+def logged_file_path(path):
+    """function to get the path of a file as it is recorded in the load log.
+    Files in the data folder are recorded relative to it, so loan.db does not depend on where the repo is checked out"""
+    data_dir = os.path.abspath(data_file_path(''))
+    path = os.path.abspath(path)
+    if os.path.commonpath([data_dir, path]) == data_dir:
+        return os.path.relpath(path, data_dir)
+    return path
+
+
+parquet_dir = data_file_path('parquet')
+
+
+# Source file (or glob pattern or directory) and column types of every table
+TABLES = {
+    'loans': ('loan_dataset.csv', {
+        'CustomerID':'INTEGER',
+        'LoanAmount':'INTEGER',
+        'LoanTerm':'INTEGER',
+        'InterestRate':'FLOAT',
+        'ApprovalStatus':'STRING'
+    }),
+    'customers': ('customer_data.csv', {
+        'CustomerID':'INTEGER',
+        'Name':'STRING',
+        'Surname':'STRING',
+        'Age':'INTEGER',
+        'Gender':'STRING',
+        'Income':'INTEGER',
+        'Region':'STRING'
+    }),
+    'credit': ('credit_data.csv', {
+        'CustomerID':'INTEGER',
+        'CreditScore':'INTEGER',
+        'CustomerClass':'STRING'
+    }),
+    'repayments': ('Loan_Repayments.csv', {
+        'RepaymentID':'INTEGER',
+        'RepaymentDate':'TIMESTAMP',
+        'Amount':'INTEGER',
+        'CustomerID':'INTEGER',
+        'TimeZone' : 'String'
+    }),
+    'months': ('Months.csv', {
+        'MonthID':'INTEGER',
+        'MonthName':'STRING',
+    }),
+}
+
+
+# Tables with a unique row key; new rows of other tables are found by comparing whole rows
+TABLE_KEYS = {
+    'repayments': 'RepaymentID',
+}
+
+
+# Tables whose rows carry the LoadID of the load that added them, so derived columns are only computed for new rows
+LOAD_ID_TABLES = ('repayments',)
+
+
+# Bookkeeping of which files were ingested, used by the incremental load
+load_log_qry = """CREATE TABLE IF NOT EXISTS load_log (
+               TableName STRING,
+               FilePath STRING,
+               FileSize BIGINT,
+               FileModified DOUBLE,
+               RowsInserted BIGINT,
+               LoadedAt TIMESTAMP DEFAULT current_timestamp
+               )"""
+
+
+# Version counter per table, bumped whenever its rows change, so cached query results can tell when they are stale
+table_versions_qry = """CREATE TABLE IF NOT EXISTS table_versions (
+               TableName STRING PRIMARY KEY,
+               Version BIGINT
+               )"""
+
+
+def bump_table_versions(cursor, tables):
+    """function to increment the version of tables.
+    Tables without a version start at the current time in microseconds, so a rebuilt loan.db never reuses
+    the versions of the one it replaced"""
+    cursor.execute(table_versions_qry)
+    for table in tables:
+        cursor.execute("""INSERT INTO table_versions VALUES (?, ?)
+                       ON CONFLICT (TableName) DO UPDATE SET Version = table_versions.Version + 1""",
+                       [table, time.time_ns() // 1000])
+
+
+def init_table_versions(cursor):
+    "function to give every table and view that does not have a version yet its starting version"
+    cursor.execute(table_versions_qry)
+    tables = cursor.execute("""SELECT table_name FROM information_schema.tables
+                            WHERE table_name NOT IN (SELECT TableName FROM table_versions)""").fetchall()
+    bump_table_versions(cursor, [table for (table,) in tables])
+
+
+def read_csv_sql(table, filename=False):
+    "function to get the read_csv(...) call of a table, with the list of file paths as a parameter"
+    columns = ', '.join(f"'{name}':'{dtype}'" for name, dtype in TABLES[table][1].items())
+    return f"read_csv(?, header=True, filename={filename}, columns = {{{columns}}})"
+
+
+def resolve_files(source):
+    """function to expand a table source into a sorted list of files.
+    A source can be a file, a glob pattern or a directory (all .csv files in it), relative to the data folder"""
+    if not os.path.isabs(source):
+        source = data_file_path(source)
+    if os.path.isdir(source):
+        source = os.path.join(source, '*.csv')
+    files = sorted(glob.glob(source))
+    if not files:
+        raise FileNotFoundError(f"no files match {source}")
+    return files
+
+
+def log_load(cursor, table, path, rows):
+    "function to record that a file has been ingested into a table"
+    stat = os.stat(path)
+    cursor.execute("""INSERT INTO load_log (TableName, FilePath, FileSize, FileModified, RowsInserted)
+                   VALUES (?, ?, ?, ?, ?)""",
+                   [table, logged_file_path(path), stat.st_size, stat.st_mtime, rows])
+
+
+def load_status(cursor, table, path):
+    """function to check whether a file is 'new', 'changed' or 'loaded'
+    (unchanged since it was last ingested into a table)"""
+    stat = os.stat(path)
+    logged = cursor.execute("""SELECT FileSize, FileModified FROM load_log
+                            WHERE TableName = ? AND FilePath = ?
+                            ORDER BY LoadedAt DESC LIMIT 1""",
+                            [table, logged_file_path(path)]).fetchone()
+    if logged is None:
+        return 'new'
+    if logged == (stat.st_size, stat.st_mtime):
+        return 'loaded'
+    return 'changed'
+
+
+def table_exists(cursor, table):
+    return cursor.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?",
+                          [table]).fetchone()[0] > 0
+
+
+def stage_files(cursor, table, paths):
+    """function to read files into a temporary staging table, so their rows can be compared with the table
+    before they are appended. Returns the staging table name"""
+    staging = f"staging_{table}"
+    cursor.execute(f"CREATE OR REPLACE TEMP TABLE {staging} AS SELECT * FROM {read_csv_sql(table, filename=True)}",
+                   [paths])
+    return staging
+
+
+def log_staged_files(cursor, table, staging, paths, new_rows=None):
+    """function to log every staged file with its staged row count, or with the given count of newly inserted rows.
+    Drops the staging table and returns the total number of rows logged"""
+    if new_rows is None:
+        new_rows = dict(cursor.execute(f"SELECT filename, COUNT(*) FROM {staging} GROUP BY filename").fetchall())
+    for path in paths:
+        log_load(cursor, table, path, new_rows.get(path, 0))
+    cursor.execute(f"DROP TABLE {staging}")
+    return sum(new_rows.get(path, 0) for path in paths)
+
+
+def load_id_column(table, load_id):
+    "function to get the LoadID column appended to the selected rows of a table in LOAD_ID_TABLES"
+    return f", CAST({int(load_id)} AS INTEGER) AS LoadID" if table in LOAD_ID_TABLES else ""
+
+
+def create_table(cursor, table, paths, load_id=None):
+    """function to create a table from its files in a single read.
+    The rows per file are counted on the new table from read_csv's filename column, which is dropped afterwards"""
+    cursor.execute(f"CREATE TABLE {table} AS SELECT *{load_id_column(table, load_id)} FROM {read_csv_sql(table, True)}",
+                   [paths])
+    new_rows = dict(cursor.execute(f"SELECT filename, COUNT(*) FROM {table} GROUP BY filename").fetchall())
+    cursor.execute(f"ALTER TABLE {table} DROP COLUMN filename")
+    for path in paths:
+        log_load(cursor, table, path, new_rows.get(path, 0))
+    return sum(new_rows.values())
+
+
+def append_table(cursor, table, paths, changed_paths=(), load_id=None):
+    """function to append only the rows of files that are not in its table yet.
+    Keyed tables skip rows whose key is already loaded. For unkeyed tables, files that were never loaded are
+    appended in full, while rows of files that were loaded before and have changed are compared against the
+    table (as a multiset, so duplicated source rows are kept)"""
+    staging = stage_files(cursor, table, paths)
+    # Tables can have extra columns added after loading, so only the source columns are inserted
+    columns = ', '.join(TABLES[table][1])
+    if table in LOAD_ID_TABLES:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS LoadID INTEGER")
+        insert_columns = f"{columns}, LoadID"
+    else:
+        insert_columns = columns
+    new_columns = f"*{load_id_column(table, load_id)}"
+
+    if table in TABLE_KEYS:
+        # Drop the staged rows that are already loaded, what remains is new
+        key = TABLE_KEYS[table]
+        cursor.execute(f"DELETE FROM {staging} WHERE {key} IN (SELECT {key} FROM {table} WHERE {key} IS NOT NULL)")
+        cursor.execute(f"""INSERT INTO {table} ({insert_columns})
+                       SELECT {new_columns} FROM (SELECT {columns} FROM {staging})""")
+        return log_staged_files(cursor, table, staging, paths)
+
+    new_rows = dict(cursor.execute(f"SELECT filename, COUNT(*) FROM {staging} GROUP BY filename").fetchall())
+    cursor.execute(f"""INSERT INTO {table} ({insert_columns})
+                   SELECT {new_columns} FROM (
+                       SELECT {columns} FROM {staging}
+                       WHERE filename NOT IN (SELECT UNNEST(?::VARCHAR[]))
+                   )""", [list(changed_paths)])
+    for path in changed_paths:
+        before = cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        cursor.execute(f"""INSERT INTO {table} ({insert_columns})
+                       SELECT {new_columns} FROM (
+                           SELECT {columns} FROM {staging} WHERE filename = ?
+                           EXCEPT ALL
+                           SELECT {columns} FROM {table}
+                       )""", [path])
+        new_rows[path] = cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] - before
+    return log_staged_files(cursor, table, staging, paths, new_rows)
+
+
+def load_table(connection, table, sources, incremental, load_id=None):
+    """function to load one table on its own cursor, so independent tables can load in parallel threads.
+    New rows of LOAD_ID_TABLES are stamped with load_id.
+    Returns a summary dict with the table, number of files, new rows and seconds from its start to its end"""
+    start = time.perf_counter()
+    cursor = connection.cursor()
+    paths = resolve_files(sources.get(table, TABLES[table][0]))
+
+    if not incremental or not table_exists(cursor, table):
+        loaded_paths = paths
+        rows = create_table(cursor, table, paths, load_id)
+    else:
+        status = {path: load_status(cursor, table, path) for path in paths}
+        if all(value == 'new' for value in status.values()):
+            # A table that predates the load log may already hold these files' rows
+            status = dict.fromkeys(paths, 'changed')
+        loaded_paths = [path for path in paths if status[path] != 'loaded']
+        changed_paths = [path for path in loaded_paths if status[path] == 'changed']
+        rows = append_table(cursor, table, loaded_paths, changed_paths, load_id) if loaded_paths else 0
+
+    cursor.close()
+    return {'table': table, 'files': len(loaded_paths), 'rows': rows, 'seconds': time.perf_counter() - start}
+
+
+def load_tables(connection, sources, incremental, threads=1):
+    """function to load all tables and print a per table summary.
+    With threads=1, tables load one after another, so the seconds of every table are its own. DuckDB still reads
+    the files of each table in parallel. With more threads independent tables load concurrently, which can be faster
+    in total but makes their seconds overlap.
+    The load is numbered by next_load_id, which stamps its new rows in LOAD_ID_TABLES"""
+    load_id = next_load_id(connection)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        summary = list(pool.map(lambda table: load_table(connection, table, sources, incremental, load_id), TABLES))
+    seconds = time.perf_counter() - start
+
+    for row in summary:
+        print(f"{row['table']:<12} {row['files']:>6} files {row['rows']:>12} rows {row['seconds']:>9.2f}s")
+    print(f"{'total':<12} {sum(row['files'] for row in summary):>6} files "
+          f"{sum(row['rows'] for row in summary):>12} rows {seconds:>9.2f}s"
+          + (f" ({threads} tables at a time, table seconds overlap)" if threads > 1 else ""))
+    return summary
+
+
+# Full province names as they appear in the customers table, mapped to the abbreviation used by most rows
+PROVINCE_CODES = {
+    'EasternCape': 'EC',
+    'FreeState': 'FS',
+    'Gauteng': 'GT',
+    'KwaZulu-Natal': 'KZN',
+    'Limpopo': 'LP',
+    'Mpumalanga': 'MP',
+    'NorthernCape': 'NC',
+    'NorthWest': 'NW',
+    'WesternCape': 'WC',
+}
+
+
+province_codes_qry = """CREATE OR REPLACE TABLE province_codes (
+               Region STRING PRIMARY KEY,
+               ProvinceCode STRING
+               );
+               INSERT INTO province_codes
+               SELECT Region, ProvinceCode FROM (VALUES {values}) AS codes(Region, ProvinceCode);
+               INSERT INTO province_codes
+               SELECT DISTINCT ProvinceCode, ProvinceCode FROM (VALUES {values}) AS codes(Region, ProvinceCode)"""
+
+
+# Customers deduplicated on CustomerID, with trimmed strings and a normalized province code
+customers_clean_qry = """CREATE OR REPLACE TABLE customers_clean (
+               CustomerID INTEGER PRIMARY KEY,
+               Name STRING,
+               Surname STRING,
+               Age INTEGER,
+               Gender STRING,
+               Income INTEGER,
+               Region STRING,
+               ProvinceCode STRING
+               );
+               INSERT INTO customers_clean
+               SELECT
+                   c.CustomerID,
+                   c.Name,
+                   c.Surname,
+                   c.Age,
+                   c.Gender,
+                   c.Income,
+                   c.Region,
+                   COALESCE(p.ProvinceCode, c.Region) AS ProvinceCode
+               FROM (
+                   SELECT
+                       CustomerID,
+                       MIN(TRIM(Name)) AS Name,
+                       MIN(TRIM(Surname)) AS Surname,
+                       MIN(Age) AS Age,
+                       MIN(TRIM(Gender)) AS Gender,
+                       MIN(Income) AS Income,
+                       MIN(TRIM(Region)) AS Region
+                   FROM customers
+                   WHERE CustomerID IS NOT NULL
+                   GROUP BY CustomerID
+               ) c
+               LEFT JOIN province_codes p
+                   ON p.Region = c.Region"""
+
+
+# Credit deduplicated on CustomerID, with a trimmed CustomerClass
+credit_clean_qry = """CREATE OR REPLACE TABLE credit_clean (
+               CustomerID INTEGER PRIMARY KEY,
+               CreditScore INTEGER,
+               CustomerClass STRING
+               );
+               INSERT INTO credit_clean
+               SELECT
+                   CustomerID,
+                   MIN(CreditScore) AS CreditScore,
+                   MIN(TRIM(CustomerClass)) AS CustomerClass
+               FROM credit
+               WHERE CustomerID IS NOT NULL
+               GROUP BY CustomerID"""
+
+
+# Time zone abbreviations in the repayments table, with their IANA zone and standard UTC offset in minutes.
+# The IANA zone carries the daylight saving rules, used when a load is run with apply_dst
+TIMEZONES = {
+    'UTC': ('UTC', 0),
+    'GMT': ('Etc/GMT', 0),
+    'CET': ('CET', 60),
+    'EET': ('EET', 120),
+    'IST': ('Asia/Kolkata', 330),
+    'JST': ('Asia/Tokyo', 540),
+    'PST': ('America/Los_Angeles', -480),
+    'PNT': ('America/Phoenix', -420),
+    'CST': ('America/Chicago', -360),
+}
+
+
+# Settings a database was loaded with, such as the daylight saving mode, so later incremental loads can reuse them
+load_settings_qry = """CREATE TABLE IF NOT EXISTS load_settings (
+               Name STRING PRIMARY KEY,
+               Value STRING
+               )"""
+
+
+def set_load_setting(cursor, name, value):
+    "function to record a setting the database was loaded with"
+    cursor.execute(load_settings_qry)
+    cursor.execute("INSERT OR REPLACE INTO load_settings VALUES (?, ?)", [name, str(value)])
+
+
+def get_load_setting(cursor, name):
+    "function to get a setting the database was loaded with, or None if it was never recorded"
+    if not table_exists(cursor, 'load_settings'):
+        return None
+    row = cursor.execute("SELECT Value FROM load_settings WHERE Name = ?", [name]).fetchone()
+    return None if row is None else row[0]
+
+
+def next_load_id(cursor):
+    "function to number a new load, counting up from the last recorded LoadID"
+    load_id = int(get_load_setting(cursor, 'load_id') or 0) + 1
+    set_load_setting(cursor, 'load_id', load_id)
+    return load_id
+
+
+def load_apply_dst(cursor, apply_dst=None):
+    """function to get the daylight saving mode of a load, and record it.
+    By default the abbreviations are fixed offsets, which is what Advanced_SQL.question_4 assumes. With apply_dst,
+    repayment times are converted with the IANA zone rules instead. A database keeps the mode of its first load:
+    apply_dst=None reuses it, and a different mode raises a ValueError because it would mix two conversions"""
+    recorded = get_load_setting(cursor, 'apply_dst')
+    if recorded is not None:
+        recorded = recorded == 'True'
+        if apply_dst is not None and apply_dst != recorded:
+            raise ValueError(f"the database was loaded with apply_dst={recorded}, "
+                             f"run a full load to convert the repayments with apply_dst={apply_dst}")
+        return recorded
+    apply_dst = bool(apply_dst)
+    set_load_setting(cursor, 'apply_dst', apply_dst)
+    return apply_dst
+
+
+timezones_qry = """CREATE OR REPLACE TABLE timezones (
+               TimeZone STRING PRIMARY KEY,
+               IanaZone STRING,
+               StandardOffsetMinutes INTEGER
+               );
+               INSERT INTO timezones
+               SELECT * FROM (VALUES {values}) AS zones(TimeZone, IanaZone, StandardOffsetMinutes)"""
+
+
+# Persisted GMT repayment time with integer month and hour columns, filled in for the new rows selected by {new_rows}.
+# Time zones missing from the timezones table are treated as GMT
+repayments_gmt_qry = """ALTER TABLE repayments ADD COLUMN IF NOT EXISTS LoadID INTEGER;
+               ALTER TABLE repayments ADD COLUMN IF NOT EXISTS RepaymentDateGMT TIMESTAMP;
+               ALTER TABLE repayments ADD COLUMN IF NOT EXISTS RepaymentMonth INTEGER;
+               ALTER TABLE repayments ADD COLUMN IF NOT EXISTS RepaymentHourGMT INTEGER;
+               UPDATE repayments r
+               SET RepaymentDateGMT = {gmt_expression}
+               FROM timezones t
+               WHERE t.TimeZone = r.TimeZone
+               AND {new_rows}
+               AND r.RepaymentDateGMT IS NULL;
+               UPDATE repayments
+               SET RepaymentDateGMT = RepaymentDate
+               WHERE {new_rows}
+               AND RepaymentDateGMT IS NULL"""
+
+
+# Filled in last, after repayment_summary_delta_qry has added the new rows to the summary
+repayments_month_qry = """UPDATE repayments
+               SET RepaymentMonth = CAST(month(RepaymentDateGMT) AS INTEGER),
+                   RepaymentHourGMT = CAST(hour(RepaymentDateGMT) AS INTEGER)
+               WHERE {new_rows}"""
+
+
+def new_repayments_sql(cursor):
+    """function to get the condition that selects the repayments added since the derived columns were last filled in.
+    Those are the rows with a LoadID after the 'derived_load_id' setting. A database whose derived columns were
+    filled in by an older loader has no setting yet, and its new rows are the ones without a RepaymentMonth"""
+    derived_load_id = get_load_setting(cursor, 'derived_load_id')
+    if derived_load_id is None:
+        return "RepaymentMonth IS NULL"
+    return f"LoadID > {int(derived_load_id)}"
+
+
+def repayments_gmt_sql(apply_dst=False, new_rows="RepaymentMonth IS NULL"):
+    "function to get the query that fills in the GMT repayment columns of the rows matching the new_rows condition"
+    if apply_dst:
+        gmt_expression = "timezone('UTC', timezone(t.IanaZone, r.RepaymentDate))"
+    else:
+        gmt_expression = "r.RepaymentDate - INTERVAL (t.StandardOffsetMinutes) MINUTE"
+    return repayments_gmt_qry.format(gmt_expression=gmt_expression, new_rows=new_rows)
+
+
+# Number and total of the repayments per customer per month between 6am and 6pm GMT, as in Advanced_SQL.question_4.
+# Only customer-months with repayments are stored, built from the rows that already have a RepaymentMonth
+repayment_summary_qry = """CREATE OR REPLACE TABLE repayment_summary (
+               CustomerID INTEGER,
+               MonthID INTEGER,
+               NumberOfRepayments BIGINT,
+               AmountTotal HUGEINT,
+               PRIMARY KEY (CustomerID, MonthID)
+               );
+               INSERT INTO repayment_summary
+               SELECT
+                   CustomerID,
+                   RepaymentMonth AS MonthID,
+                   COUNT(RepaymentID) AS NumberOfRepayments,
+                   COALESCE(SUM(Amount), 0) AS AmountTotal
+               FROM repayments
+               WHERE CustomerID IS NOT NULL
+               AND RepaymentHourGMT >= 6
+               AND RepaymentHourGMT < 18
+               GROUP BY CustomerID, RepaymentMonth"""
+
+
+# Adds the repayments appended since the last build, selected by {new_rows}, to repayment_summary
+repayment_summary_delta_qry = """INSERT INTO repayment_summary
+               SELECT
+                   CustomerID,
+                   CAST(month(RepaymentDateGMT) AS INTEGER) AS MonthID,
+                   COUNT(RepaymentID) AS NumberOfRepayments,
+                   COALESCE(SUM(Amount), 0) AS AmountTotal
+               FROM repayments
+               WHERE {new_rows}
+               AND CustomerID IS NOT NULL
+               AND hour(RepaymentDateGMT) >= 6
+               AND hour(RepaymentDateGMT) < 18
+               GROUP BY CustomerID, MonthID
+               ON CONFLICT (CustomerID, MonthID) DO UPDATE SET
+                   NumberOfRepayments = NumberOfRepayments + excluded.NumberOfRepayments,
+                   AmountTotal = AmountTotal + excluded.AmountTotal"""
+
+
+# One row per customer with a <Month>Repayments and <Month>Total column per month, read from repayment_summary
+repayment_pivot_qry = """CREATE OR REPLACE VIEW repayment_pivot AS
+               SELECT
+                   c.CustomerID,
+                   {columns}
+               FROM customers_clean c
+               LEFT JOIN repayment_summary s
+                   ON s.CustomerID = c.CustomerID
+               GROUP BY c.CustomerID"""
+
+pivot_column_qry = """CAST(SUM(CASE WHEN s.MonthID = {month} THEN s.NumberOfRepayments ELSE 0 END) AS INTEGER)
+                       AS {name}Repayments,
+                   SUM(CASE WHEN s.MonthID = {month} THEN s.AmountTotal ELSE 0 END) AS {name}Total"""
+
+
+# Tables derived from the loaded tables, in build order, with the tables they are derived from
+DERIVED_TABLES = {
+    'province_codes': ((), province_codes_qry.format(
+        values=', '.join(f"('{region}', '{code}')" for region, code in PROVINCE_CODES.items()))),
+    'customers_clean': (('customers', 'province_codes'), customers_clean_qry),
+    'credit_clean': (('credit',), credit_clean_qry),
+    'timezones': ((), timezones_qry.format(
+        values=', '.join(f"('{zone}', '{iana}', {offset})" for zone, (iana, offset) in TIMEZONES.items()))),
+}
+
+
+def execute_statements(cursor, qry):
+    """function to run a multi-statement query one statement at a time.
+    DuckDB fails to run a batch of statements once a table in the connection has been altered"""
+    for statement in qry.split(';'):
+        cursor.execute(statement)
+
+
+def dependent_tables(tables):
+    "function to list the derived tables that depend on any of tables, directly or through other derived tables"
+    changed_tables = set(tables)
+    dependents = []
+    for table, (sources, _) in DERIVED_TABLES.items():
+        if changed_tables.intersection(sources):
+            dependents.append(table)
+            changed_tables.add(table)
+    if 'repayments' in changed_tables:
+        dependents.append('repayment_summary')
+    return dependents
+
+
+def rebuild_derived_tables(cursor, changed_tables=None):
+    """function to rebuild the tables of DERIVED_TABLES, all of them without changed_tables.
+    With changed_tables, only derived tables that are missing or depend on a changed table are rebuilt.
+    Returns the rebuilt tables"""
+    changed_tables = None if changed_tables is None else set(changed_tables)
+    rebuilt = []
+    for table, (sources, qry) in DERIVED_TABLES.items():
+        if changed_tables is None or changed_tables.intersection(sources) or not table_exists(cursor, table):
+            execute_statements(cursor, qry)
+            rebuilt.append(table)
+            if changed_tables is not None:
+                changed_tables.add(table)
+    return rebuilt
+
+
+def rebuild_repayment_summary(cursor):
+    """function to rebuild repayment_summary from scratch after repayments were written outside the loader.
+    Rows written without a RepaymentMonth get their GMT columns first, in the daylight saving mode of the loads.
+    An UPDATE or DELETE cannot be applied as a delta, so the whole summary is rebuilt"""
+    new_rows = "RepaymentMonth IS NULL"
+    execute_statements(cursor, repayments_gmt_sql(load_apply_dst(cursor), new_rows))
+    cursor.execute(repayments_month_qry.format(new_rows=new_rows))
+    execute_statements(cursor, repayment_summary_qry)
+
+
+def refresh_derived_tables(cursor, changed_tables=()):
+    """function to bring the derived tables up to date after changed_tables were written outside the loader,
+    e.g. by the UPDATE credit of SQL.question_5. Derived tables missing from a loan.db built by an older loader
+    are built too. Bumps and returns the rebuilt tables"""
+    if all(table_exists(cursor, table) for table in ('repayment_summary', 'repayment_pivot')):
+        rebuilt = rebuild_derived_tables(cursor, changed_tables)
+        if 'repayments' in changed_tables:
+            rebuild_repayment_summary(cursor)
+            rebuilt.append('repayment_summary')
+    else:
+        rebuilt = build_derived_tables(cursor, changed_tables)
+    bump_table_versions(cursor, rebuilt)
+    init_table_versions(cursor)
+    return rebuilt
+
+
+def build_derived_tables(cursor, changed_tables=None, apply_dst=None):
+    """function to (re)build the derived tables.
+    With changed_tables, only derived tables that are missing or depend on a changed table are rebuilt.
+    New repayments are converted to GMT with the daylight saving mode of load_apply_dst(cursor, apply_dst).
+    They are selected by the LoadID of the loads since the last build, see new_repayments_sql.
+    Returns the derived tables whose rows may have changed"""
+    rebuilt = rebuild_derived_tables(cursor, changed_tables)
+
+    # Views over Parquet files already carry these columns from the export
+    is_view = cursor.execute("SELECT COUNT(*) FROM duckdb_views() WHERE view_name = 'repayments'").fetchone()[0] > 0
+    if not is_view:
+        new_rows = new_repayments_sql(cursor)
+        execute_statements(cursor, repayments_gmt_sql(load_apply_dst(cursor, apply_dst), new_rows))
+
+    # The summary is built once and after that only receives the deltas of newly appended repayments
+    if is_view or not table_exists(cursor, 'repayment_summary'):
+        execute_statements(cursor, repayment_summary_qry)
+    if not is_view:
+        cursor.execute(repayment_summary_delta_qry.format(new_rows=new_rows))
+        cursor.execute(repayments_month_qry.format(new_rows=new_rows))
+        set_load_setting(cursor, 'derived_load_id', get_load_setting(cursor, 'load_id') or 0)
+    months = enumerate(calendar.month_name[1:], start=1)
+    cursor.execute(repayment_pivot_qry.format(columns=',\n                   '.join(
+        pivot_column_qry.format(month=month, name=name) for month, name in months)))
+
+    if changed_tables is None or 'repayments' in changed_tables:
+        rebuilt.append('repayment_summary')
+    return rebuilt
+
+
+def full_load(database_path=database_path, sources=None, threads=1, apply_dst=False):
+    """function to rebuild loan.db from scratch.
+    With apply_dst, repayment times are converted to GMT with daylight saving rules instead of fixed offsets"""
+    # Delete the existing loan.db if it exists
+    if os.path.exists(database_path):
+        os.remove(database_path)
+    cursor = duckdb.connect(database_path)
+
+    cursor.execute(load_log_qry)
+    load_apply_dst(cursor, apply_dst)
+    summary = load_tables(cursor, sources or {}, incremental=False, threads=threads)
+    build_derived_tables(cursor)
+    init_table_versions(cursor)
+
+    cursor.close()
+    return summary
+
+
+def incremental_load(database_path=database_path, sources=None, threads=1, apply_dst=None):
+    """function to bring loan.db up to date without dropping it.
+    Files that are unchanged since their last load are skipped, new and changed files only append their new rows,
+    and existing tables, indexes and derived tables are kept.
+    New repayments use the daylight saving mode loan.db was loaded with, a different apply_dst raises a ValueError"""
+    cursor = duckdb.connect(database_path)
+    cursor.execute(load_log_qry)
+    try:
+        load_apply_dst(cursor, apply_dst)
+    except ValueError:
+        cursor.close()
+        raise
+
+    summary = load_tables(cursor, sources or {}, incremental=True, threads=threads)
+    changed_tables = [row['table'] for row in summary if row['rows']]
+    changed_tables += build_derived_tables(cursor, changed_tables)
+    bump_table_versions(cursor, changed_tables)
+    init_table_versions(cursor)
+
+    cursor.close()
+    return summary
+
+
+# Parquet partition columns per table; repayments are split into one directory per month
+PARQUET_PARTITIONS = {
+    'repayments': ("SELECT * FROM repayments", 'RepaymentMonth'),
+}
+
+
+def export_parquet(database_path=database_path, output_dir=parquet_dir):
+    """function to write every table of loan.db to Parquet, one file per table,
+    or a hive partitioned directory for tables in PARQUET_PARTITIONS"""
+    cursor = duckdb.connect(database_path, read_only=True)
+    os.makedirs(output_dir, exist_ok=True)
+
+    for table in TABLES:
+        if table in PARQUET_PARTITIONS:
+            select_qry, partition = PARQUET_PARTITIONS[table]
+            target = os.path.join(output_dir, table)
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            cursor.execute(f"COPY ({select_qry}) TO '{target}' (FORMAT PARQUET, PARTITION_BY ({partition}))")
+        else:
+            cursor.execute(f"COPY {table} TO '{os.path.join(output_dir, table)}.parquet' (FORMAT PARQUET)")
+
+    cursor.close()
+
+
+def external_load(database_path=database_path, parquet_dir=parquet_dir):
+    """function to rebuild loan.db with views over the Parquet files from export_parquet instead of tables.
+    No rows are copied in, so queries read the files directly with partition pruning and column projection"""
+    if os.path.exists(database_path):
+        os.remove(database_path)
+    cursor = duckdb.connect(database_path)
+
+    for table in TABLES:
+        if table in PARQUET_PARTITIONS:
+            source = os.path.abspath(os.path.join(parquet_dir, table, '*', '*.parquet'))
+            cursor.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{source}', hive_partitioning=true)")
+        else:
+            source = os.path.abspath(os.path.join(parquet_dir, f'{table}.parquet'))
+            cursor.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{source}')")
+    build_derived_tables(cursor)
+    init_table_versions(cursor)
+
+    cursor.close()
+
+
+def parse_source(value):
+    "function to parse a TABLE=PATTERN command line argument"
+    table, _, source = value.partition('=')
+    if table not in TABLES or not source:
+        raise argparse.ArgumentTypeError(f"expected TABLE=PATTERN with TABLE one of {', '.join(TABLES)}")
+    return table, source
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the Task_1 CSV files into loan.db")
+    parser.add_argument('--incremental', action='store_true',
+                        help="append only new rows to the existing database instead of rebuilding it")
+    parser.add_argument('--source', type=parse_source, action='append', default=[], metavar='TABLE=PATTERN',
+                        help="file, glob pattern or directory to load a table from, e.g. repayments='repayments/*.csv'")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="number of tables to load concurrently, 1 times every table on its own")
+    parser.add_argument('--export-parquet', nargs='?', const=parquet_dir, metavar='DIR',
+                        help="after loading, also write the tables to Parquet (default data/parquet)")
+    parser.add_argument('--external', nargs='?', const=parquet_dir, metavar='DIR',
+                        help="build loan.db as views over previously exported Parquet files "
+                             "instead of loading the CSVs")
+    parser.add_argument('--dst', action='store_true', default=None,
+                        help="convert repayment times to GMT with daylight saving rules instead of fixed offsets, "
+                             "incremental loads reuse the mode of the existing database by default")
+    args = parser.parse_args()
+
+    if args.external:
+        if args.incremental or args.source or args.export_parquet:
+            parser.error("--external cannot be combined with --incremental, --source or --export-parquet")
+        external_load(parquet_dir=args.external)
+    elif args.incremental:
+        incremental_load(sources=dict(args.source), threads=args.threads, apply_dst=args.dst)
+    else:
+        full_load(sources=dict(args.source), threads=args.threads, apply_dst=bool(args.dst))
+
+    if args.export_parquet:
+        export_parquet(output_dir=args.export_parquet)
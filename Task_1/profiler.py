@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+import duckdb
+import pandas as pd
+
+from batch_runner import discover_questions
+from database.database_load import database_path
+from query_cache import normalize_sql, split_statements, written_tables
+
+"""
+Profiling mode for the `question_*` queries in SQL.py and Advanced_SQL.py.
+
+'profile_questions()' runs every question with DuckDB's JSON profiler enabled and records, per statement, the operator
+tree with the time and number of rows of every operator, and the peak memory of DuckDB's buffer manager while the
+statement ran. The profiles are saved as JSON, next to a summary that ranks the questions and the operators by time:
+
+    python profiler.py --output profiles
+
+The questions run against a temporary copy of loan.db, so the writing questions do not change it. With --repeat,
+only read-only questions are run more than once, since a writing question would run again on the rows it wrote.
+Pass a previous profile JSON with --baseline to compare the timings of every question against it.
+
+"""
+
+# Poll interval of the buffer manager memory while a statement runs
+MEMORY_POLL_SECONDS = 0.001
+
+_UNITS = {"bytes": 1, "KB": 2**10, "MB": 2**20, "GB": 2**30, "TB": 2**40}
+
+
+def _parse_memory(value):
+    """
+    Convert a DuckDB memory string such as '589KB' or '1.2GB' to bytes.
+    """
+
+    number, unit = re.fullmatch(r"([\d.]+)\s*(\w+)", value.strip()).groups()
+    return int(float(number) * _UNITS.get(unit, 1))
+
+
+def _flatten_operators(node, depth=0):
+    """
+    Flatten a profiled operator tree into one record per operator, in plan order.
+    """
+
+    operators = []
+    for child in node.get("children", []):
+        operators.append(
+            {
+                "operator": child["name"].strip(),
+                "depth": depth,
+                "seconds": child["timing"],
+                "rows": child["cardinality"],
+                "extra_info": child.get("extra_info", "").split("[INFOSEPARATOR]")[0].strip(),
+            }
+        )
+        operators.extend(_flatten_operators(child, depth + 1))
+    return operators
+
+
+def _watch_memory(cursor, stop, peak):
+    """
+    Track the largest buffer manager memory usage until stop is set.
+    """
+
+    while not stop.is_set():
+        usage = cursor.execute("SELECT memory_usage FROM pragma_database_size()").fetchone()[0]
+        peak[0] = max(peak[0], _parse_memory(usage))
+        stop.wait(MEMORY_POLL_SECONDS)
+
+
+def profile_statement(connection, statement, profile_path):
+    """
+    Execute one SQL statement with profiling enabled.
+
+    Args:
+        connection (DuckDBPyConnection): Connection to run the statement on
+        statement (str): A single SQL statement
+        profile_path (str): Scratch file DuckDB writes the JSON profile to
+
+    Returns:
+        dict: `sql`, `seconds`, `rows` of the result, `peak_memory_bytes`, the flat `operators` list and the raw `plan`.
+
+    """
+
+    stop = threading.Event()
+    peak = [0]
+    monitor_cursor = connection.cursor()
+    monitor = threading.Thread(target=_watch_memory, args=(monitor_cursor, stop, peak))
+
+    if os.path.exists(profile_path):
+        os.remove(profile_path)
+    connection.execute("PRAGMA enable_profiling='json'")
+    connection.execute(f"PRAGMA profiling_output='{profile_path}'")
+    monitor.start()
+    start = time.perf_counter()
+    try:
+        rows = len(connection.execute(statement).fetchall())
+    finally:
+        seconds = time.perf_counter() - start
+        stop.set()
+        monitor.join()
+        monitor_cursor.close()
+        connection.execute("PRAGMA disable_profiling")
+
+    # DuckDB writes no profile for statements without a physical plan, such as DROP TABLE
+    plan = {"name": "Query", "timing": seconds, "cardinality": rows, "children": []}
+    if os.path.exists(profile_path):
+        with open(profile_path) as f:
+            plan = json.load(f)
+
+    return {
+        "sql": statement,
+        "seconds": plan["timing"],
+        "rows": rows,
+        "peak_memory_bytes": peak[0],
+        "operators": _flatten_operators(plan),
+        "plan": plan,
+    }
+
+
+def profile_questions(questions=None, database=database_path, repeat=1):
+    """
+    Profile every question, statement by statement, on a temporary copy of the database.
+
+    Args:
+        questions (list): (name, function) pairs, all questions of SQL.py and Advanced_SQL.py by default
+        database (str): DuckDB database file to copy
+        repeat (int): Number of profiled runs per read-only question, the fastest one is kept.
+            Questions that write run once, so every question sees the database the one before it left
+
+    Returns:
+        list: One dict per question with `question`, `seconds`, `peak_memory_bytes` and its `statements` profiles.
+
+    """
+
+    questions = discover_questions() if questions is None else questions
+    profiles = []
+
+    with tempfile.TemporaryDirectory() as scratch:
+        copy_path = os.path.join(scratch, "loan.db")
+        shutil.copy(database, copy_path)
+        profile_path = os.path.join(scratch, "profile.json")
+
+        with duckdb.connect(copy_path) as connection:
+            for name, question in questions:
+                sql_statements = split_statements(normalize_sql(question()))
+                runs = []
+                for _ in range(repeat if written_tables(sql_statements) is None else 1):
+                    statements = [
+                        profile_statement(connection, statement, profile_path) for statement in sql_statements
+                    ]
+                    runs.append(statements)
+                statements = min(runs, key=lambda run: sum(statement["seconds"] for statement in run))
+                profiles.append(
+                    {
+                        "question": name,
+                        "seconds": sum(statement["seconds"] for statement in statements),
+                        "peak_memory_bytes": max(statement["peak_memory_bytes"] for statement in statements),
+                        "statements": statements,
+                    }
+                )
+
+    return profiles
+
+
+def operator_costs(profiles):
+    """
+    List every profiled operator with its question, ranked by time.
+
+    Args:
+        profiles (list): Output of 'profile_questions()'
+
+    Returns:
+        DataFrame: Columns `Question`, `Statement`, `Operator`, `Seconds`, `Rows`, `Share` of the question's time
+            and `Detail`, the start of the operator's extra info (e.g. the join condition or filter).
+
+    """
+
+    rows = []
+    for profile in profiles:
+        for number, statement in enumerate(profile["statements"], start=1):
+            for operator in statement["operators"]:
+                rows.append(
+                    {
+                        "Question": profile["question"],
+                        "Statement": number,
+                        "Operator": operator["operator"],
+                        "Seconds": operator["seconds"],
+                        "Rows": operator["rows"],
+                        "Share": operator["seconds"] / profile["seconds"] if profile["seconds"] else 0.0,
+                        "Detail": " ".join(operator["extra_info"].split())[:80],
+                    }
+                )
+    df_operators = pd.DataFrame(
+        rows, columns=["Question", "Statement", "Operator", "Seconds", "Rows", "Share", "Detail"]
+    )
+    return df_operators.sort_values("Seconds", ascending=False, kind="mergesort").reset_index(drop=True)
+
+
+def question_costs(profiles):
+    """
+    Rank the questions by profiled time.
+    """
+
+    df_questions = pd.DataFrame(
+        [
+            {
+                "Question": profile["question"],
+                "Seconds": profile["seconds"],
+                "Statements": len(profile["statements"]),
+                "PeakMemoryBytes": profile["peak_memory_bytes"],
+            }
+            for profile in profiles
+        ]
+    )
+    return df_questions.sort_values("Seconds", ascending=False, kind="mergesort").reset_index(drop=True)
+
+
+def compare_profiles(baseline, profiles):
+    """
+    Compare question timings against a baseline run, to spot regressions.
+
+    Args:
+        baseline (list): Profiles of an earlier run, e.g. loaded from its JSON file
+        profiles (list): Profiles of the current run
+
+    Returns:
+        DataFrame: Columns `Question`, `BaselineSeconds`, `Seconds` and `Ratio`, slowest relative to the baseline first.
+
+    """
+
+    df_baseline = question_costs(baseline)[["Question", "Seconds"]].rename(columns={"Seconds": "BaselineSeconds"})
+    df_compare = df_baseline.merge(question_costs(profiles)[["Question", "Seconds"]], on="Question")
+    df_compare["Ratio"] = df_compare["Seconds"] / df_compare["BaselineSeconds"]
+    return df_compare.sort_values("Ratio", ascending=False, kind="mergesort").reset_index(drop=True)
+
+
+def summarize(profiles, top=15):
+    """
+    Readable report of the questions and the top operators, ranked by time.
+    """
+
+    df_questions = question_costs(profiles)
+    df_operators = operator_costs(profiles).head(top)
+    total = df_questions["Seconds"].sum()
+    return "\n".join(
+        [
+            f"{len(profiles)} questions, {total:.4f}s profiled",
+            "",
+            "Questions by time:",
+            df_questions.to_string(index=False),
+            "",
+            f"Top {len(df_operators)} operators by time:",
+            df_operators.to_string(index=False),
+        ]
+    )
+
+
+def write_profiles(profiles, output_dir):
+    """
+    Save the profiles as 'profile.json' and the report of 'summarize()' as 'summary.txt' in output_dir.
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "profile.json"), "w") as f:
+        json.dump(profiles, f, indent=2)
+    with open(os.path.join(output_dir, "summary.txt"), "w") as f:
+        f.write(summarize(profiles) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile every question of SQL.py and Advanced_SQL.py")
+    parser.add_argument("--output", default="profiles", help="directory for profile.json and summary.txt")
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="profiled runs per read-only question, the fastest is kept"
+    )
+    parser.add_argument("--baseline", help="profile.json of an earlier run to compare against")
+    args = parser.parse_args()
+
+    profiles = profile_questions(repeat=args.repeat)
+    write_profiles(profiles, args.output)
+    print(summarize(profiles))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            print("\nCompared to the baseline:")
+            print(compare_profiles(json.load(f), profiles).to_string(index=False))
@@ -0,0 +1,242 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import duckdb
+
+from database.database_load import bump_table_versions, database_path, refresh_derived_tables
+
+"""
+Result cache for the `question_*` query functions in SQL.py and Advanced_SQL.py.
+
+'run_query()' executes a query against loan.db and returns its result as an Arrow table. Read-only queries are cached
+under the database file, their normalized SQL and the version of every table they read, so a cached result is reused
+until one of those tables changes. The loader bumps the versions in the `table_versions` table on every load. Queries
+that write (`UPDATE`, `INSERT`, `CREATE TABLE`, `DROP`, ...) are never cached: they bump the versions of the tables
+they write and rebuild the derived tables of 'database_load.DERIVED_TABLES' that depend on them, e.g. `credit_clean`
+after the `UPDATE credit` of SQL.question_5.
+
+    import SQL as sql
+    from query_cache import run_question
+
+    result_set = run_question(sql.question_1).to_pandas()
+
+Read-only queries never write to loan.db, so they also run on read-only connections. Derived tables missing from a
+loan.db built by an older loader are built by the loader or 'batch_runner', not here.
+
+Changes made to loan.db without going through the loader or 'run_query()' are not seen by the cache, and leave the
+derived tables stale until 'database_load.refresh_derived_tables()' or an incremental load rebuilds them.
+
+"""
+
+# Quoted literals and identifiers are kept as they are, comments and runs of whitespace become a single space
+_SQL_TOKENS = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|(--[^\n]*|/\*.*?\*/)|(\s+)""", re.S)
+
+# Semicolons outside single quoted literals
+_STATEMENT_SEPARATOR = re.compile(r";(?=(?:[^']*'[^']*')*[^']*$)")
+
+# Single quoted literals, blanked before looking for keywords
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+_READ_ONLY = re.compile(r"^\(*\s*(SELECT|WITH|VALUES|FROM)\b", re.I)
+
+# A statement that writes anywhere, including after a WITH clause such as WITH x AS (...) INSERT INTO ...
+_WRITE_KEYWORD = re.compile(r"\b(INSERT|UPDATE|DELETE|TRUNCATE|CREATE|DROP|ALTER|COPY)\b", re.I)
+
+# Normalized SQL has single spaces, so the lookbehind skips INSERT ... ON CONFLICT DO UPDATE SET
+_WRITTEN_TABLE = re.compile(
+    r"""\b(?:(?<!DO\s)UPDATE
+        |INSERT\s+(?:OR\s+\w+\s+)?INTO
+        |DELETE\s+FROM
+        |TRUNCATE(?:\s+TABLE)?
+        |ALTER\s+TABLE
+        |CREATE\s+(?:OR\s+REPLACE\s+)?(?:TEMP\w*\s+)?(?:TABLE|VIEW)(?:\s+IF\s+NOT\s+EXISTS)?
+        |DROP\s+(?:TABLE|VIEW)(?:\s+IF\s+EXISTS)?
+        )\s+"?(\w+)""",
+    re.I | re.X,
+)
+
+
+def normalize_sql(qry):
+    """
+    Normalize a query so that formatting differences do not change its cache key.
+
+    Args:
+        qry (str): SQL text, possibly with several statements
+
+    Returns:
+        str: The SQL without comments, with whitespace collapsed and without a trailing semicolon.
+
+    """
+
+    def replace(match):
+        literal = match.group(1)
+        return literal if literal is not None else " "
+
+    return _SQL_TOKENS.sub(replace, qry).strip().rstrip(";").strip()
+
+
+def split_statements(qry):
+    """
+    Split normalized SQL into its statements.
+    """
+
+    return [statement.strip() for statement in _STATEMENT_SEPARATOR.split(qry) if statement.strip()]
+
+
+def written_tables(statements):
+    """
+    Find the tables that a list of statements writes to, or None if they only read.
+    """
+
+    statements = [_STRING_LITERAL.sub("''", statement) for statement in statements]
+    if all(_READ_ONLY.match(statement) and not _WRITE_KEYWORD.search(statement) for statement in statements):
+        return None
+    return sorted({match.group(1) for statement in statements for match in _WRITTEN_TABLE.finditer(statement)})
+
+
+def database_file(cursor):
+    """
+    Resolved path of the database file the cursor is connected to, or None for an in-memory database.
+    """
+
+    path = cursor.execute("SELECT file FROM pragma_database_list WHERE name = current_database()").fetchone()[0]
+    return os.path.realpath(path) if path else None
+
+
+def table_versions(cursor, tables):
+    """
+    Look up the version of every table, with None for tables that have no version.
+    """
+
+    has_versions = cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = 'table_versions'"
+    ).fetchone()[0]
+    versions = {}
+    if has_versions and tables:
+        versions = dict(
+            cursor.execute(
+                "SELECT TableName, Version FROM table_versions WHERE TableName IN (SELECT UNNEST(?::VARCHAR[]))",
+                [sorted(tables)],
+            ).fetchall()
+        )
+    return tuple((table, versions.get(table)) for table in sorted(tables))
+
+
+class QueryCache:
+    """
+    Least recently used store of Arrow query results, bounded by their total size in bytes.
+    Safe to share between threads.
+
+    Args:
+        max_bytes (int): Largest total size of the cached results, results larger than this are not cached
+
+    """
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        """
+        Return the cached result for key, or None, marking it as the most recently used.
+        """
+
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._results.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        """
+        Cache a result, evicting the least recently used results until it fits.
+        """
+
+        if result.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._results:
+                self.total_bytes -= self._results.pop(key).nbytes
+            while self._results and self.total_bytes + result.nbytes > self.max_bytes:
+                self.total_bytes -= self._results.popitem(last=False)[1].nbytes
+            self._results[key] = result
+            self.total_bytes += result.nbytes
+
+    def clear(self):
+        """
+        Drop every cached result.
+        """
+
+        with self._lock:
+            self._results.clear()
+            self.total_bytes = 0
+
+
+default_cache = QueryCache()
+
+
+def run_query(qry, cursor=None, cache=default_cache):
+    """
+    Execute a query, serving read-only queries from the cache while the tables they read are unchanged.
+
+    Args:
+        qry (str): SQL text, e.g. the return value of a `question_*` function
+        cursor (DuckDBPyConnection): Connection to loan.db, opened and closed per call if omitted
+        cache (QueryCache): Cache to use, None to always execute the query
+
+    Returns:
+        pyarrow.Table: The result set of the last statement.
+
+    """
+
+    if cursor is None:
+        with duckdb.connect(database_path) as cursor:
+            return run_query(qry, cursor, cache)
+
+    normalized = normalize_sql(qry)
+    statements = split_statements(normalized)
+    writes = written_tables(statements)
+
+    if writes is not None:
+        result = cursor.execute(qry).arrow()
+        # Derived tables such as credit_clean are rebuilt from the tables the query wrote
+        bump_table_versions(cursor, writes)
+        refresh_derived_tables(cursor, writes)
+        return result
+
+    # Queries reading a table without a version cannot be invalidated, so they are not cached. Copies of loan.db share
+    # their versions, so the key includes the database file, and in-memory databases are not cached.
+    tables = set().union(*(cursor.get_table_names(statement) for statement in statements))
+    versions = table_versions(cursor, tables)
+    database = database_file(cursor)
+    cacheable = cache is not None and database is not None and all(version is not None for _, version in versions)
+    key = (database, normalized, versions)
+    if cacheable:
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    result = cursor.execute(qry).arrow()
+    if cacheable:
+        cache.put(key, result)
+    return result
+
+
+def run_question(question, cursor=None, cache=default_cache):
+    """
+    Run a `question_*` function through 'run_query()', e.g. run_question(sql.question_1).
+    """
+
+    return run_query(question(), cursor, cache)
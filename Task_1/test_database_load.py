@@ -0,0 +1,189 @@
+import importlib.util
+import os
+import shutil
+from collections import Counter
+
+import duckdb
+import pandas as pd
+import pytest
+
+import SQL as sql
+from batch_runner import discover_questions
+from database.database_load import (
+    PROVINCE_CODES,
+    TABLES,
+    data_file_path,
+    database_path,
+    export_parquet,
+    external_load,
+    full_load,
+    get_load_setting,
+    incremental_load,
+    resolve_files,
+)
+from query_cache import normalize_sql, run_query, split_statements, written_tables
+
+"""
+Tests for the loader, run against copies of loan.db so the committed database is not changed.
+
+"""
+
+# Task_2 has a benchmark module too, so this one is loaded from its file under a name of its own
+_benchmark_spec = importlib.util.spec_from_file_location(
+    "task_1_benchmark", os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark.py")
+)
+benchmark = importlib.util.module_from_spec(_benchmark_spec)
+_benchmark_spec.loader.exec_module(benchmark)
+
+
+@pytest.fixture
+def loan_db(tmp_path):
+    path = str(tmp_path / "loan.db")
+    shutil.copy(database_path, path)
+    return path
+
+
+def test_full_load_records_the_dst_mode(tmp_path):
+    path = str(tmp_path / "loan.db")
+    full_load(path, threads=1, apply_dst=True)
+
+    with duckdb.connect(path) as cursor:
+        assert get_load_setting(cursor, 'apply_dst') == 'True'
+        # Files in the data folder are logged relative to it
+        assert [path for (path,) in cursor.execute("SELECT FilePath FROM load_log ORDER BY FilePath").fetchall()] == [
+            'Loan_Repayments.csv', 'Months.csv', 'credit_data.csv', 'customer_data.csv', 'loan_dataset.csv']
+
+
+def test_incremental_load_keeps_the_dst_mode(loan_db):
+    incremental_load(loan_db, threads=1)
+    incremental_load(loan_db, threads=1, apply_dst=False)
+    with pytest.raises(ValueError):
+        incremental_load(loan_db, threads=1, apply_dst=True)
+
+    with duckdb.connect(loan_db) as cursor:
+        assert get_load_setting(cursor, 'apply_dst') == 'False'
+
+
+def test_incremental_repayments_match_a_full_load(tmp_path):
+    repayments = pd.read_csv(data_file_path('Loan_Repayments.csv'))
+    source = tmp_path / "repayments"
+    source.mkdir()
+    repayments.iloc[:3000].to_csv(source / "part_1.csv", index=False)
+
+    incremental_db = str(tmp_path / "incremental.db")
+    full_load(incremental_db, sources={'repayments': str(source)}, threads=1)
+    repayments.iloc[3000:].to_csv(source / "part_2.csv", index=False)
+    incremental_load(incremental_db, sources={'repayments': str(source)}, threads=1)
+    full_db = str(tmp_path / "full.db")
+    full_load(full_db, sources={'repayments': str(source)}, threads=1)
+
+    qry = "SELECT * EXCLUDE (LoadID) FROM repayments ORDER BY RepaymentID"
+    summary_qry = "SELECT * FROM repayment_summary ORDER BY CustomerID, MonthID"
+    with duckdb.connect(incremental_db) as incremental, duckdb.connect(full_db) as full:
+        assert incremental.execute("SELECT LoadID, COUNT(*) FROM repayments GROUP BY 1 ORDER BY 1").fetchall() == [
+            (1, 3000), (2, len(repayments) - 3000)]
+        assert incremental.execute(qry).df().equals(full.execute(qry).df())
+        assert incremental.execute(summary_qry).df().equals(full.execute(summary_qry).df())
+
+
+def test_globbed_sources_load_in_parallel_like_single_files(tmp_path):
+    source = tmp_path / "repayments"
+    source.mkdir()
+    repayments = pd.read_csv(data_file_path('Loan_Repayments.csv'))
+    for part, start in enumerate(range(0, len(repayments), 2500)):
+        repayments.iloc[start:start + 2500].to_csv(source / f"part_{part}.csv", index=False)
+    (source / "notes.txt").write_text("not a csv")
+
+    single_db = str(tmp_path / "single.db")
+    full_load(single_db, threads=1)
+    globbed_db = str(tmp_path / "globbed.db")
+    summary = full_load(globbed_db, sources={'repayments': str(source / "part_*.csv")}, threads=4)
+
+    assert {row['table']: row['files'] for row in summary}['repayments'] == len(resolve_files(str(source)))
+    qry = "SELECT * EXCLUDE (LoadID) FROM repayments ORDER BY RepaymentID, RepaymentDate"
+    with duckdb.connect(single_db) as single, duckdb.connect(globbed_db) as globbed:
+        for table in TABLES:
+            count_qry = f"SELECT COUNT(*) FROM {table}"
+            assert globbed.execute(count_qry).fetchone() == single.execute(count_qry).fetchone(), table
+        assert globbed.execute(qry).df().equals(single.execute(qry).df())
+        logged = globbed.execute("SELECT FilePath, RowsInserted FROM load_log WHERE TableName = 'repayments'").df()
+        assert logged['RowsInserted'].sum() == len(repayments)
+        assert logged['FilePath'].str.endswith('.csv').all()
+
+    with pytest.raises(FileNotFoundError):
+        resolve_files(str(tmp_path / "missing_*.csv"))
+
+
+def test_external_views_answer_like_the_loaded_tables(tmp_path):
+    loaded_db = str(tmp_path / "loaded.db")
+    full_load(loaded_db, threads=1)
+    export_parquet(loaded_db, str(tmp_path / "parquet"))
+    external_db = str(tmp_path / "external.db")
+    external_load(external_db, str(tmp_path / "parquet"))
+
+    with duckdb.connect(loaded_db) as loaded, duckdb.connect(external_db) as external:
+        assert external.execute("SELECT COUNT(*) FROM duckdb_views() WHERE view_name = 'repayments'").fetchone()[0]
+        for name, question in discover_questions():
+            qry = question()
+            # The views are read-only, only questions that write tables of their own can run on them
+            if set(written_tables(split_statements(normalize_sql(qry))) or ()).intersection(TABLES):
+                continue
+            df_loaded = run_query(qry, loaded, None).to_pandas()
+            df_external = run_query(qry, external, None).to_pandas()
+            # Queries without an ORDER BY may return their rows in any order
+            columns = list(df_loaded.columns)
+            pd.testing.assert_frame_equal(
+                df_external.sort_values(columns).reset_index(drop=True),
+                df_loaded.sort_values(columns).reset_index(drop=True),
+                check_dtype=False,
+                obj=name,
+            )
+
+
+def test_generated_dataset_is_seeded_and_shaped_like_the_samples(tmp_path):
+    sizes = {"n_customers": 300, "n_repayments": 2000, "seed": 3, "chunk_size": 700}
+    first = benchmark.generate_dataset(str(tmp_path / "first"), **sizes)
+    second = benchmark.generate_dataset(str(tmp_path / "second"), **sizes)
+
+    for table, source in first.items():
+        # Same header and line endings as the sample file
+        with open(data_file_path(TABLES[table][0]), newline="") as sample:
+            with open(resolve_files(source)[0], newline="") as f:
+                assert f.readline() == sample.readline(), table
+        for path, other in zip(resolve_files(source), resolve_files(second[table])):
+            with open(path, "rb") as f, open(other, "rb") as g:
+                assert f.read() == g.read(), path
+    assert len(resolve_files(first['repayments'])) == 3
+
+    customers = pd.read_csv(first['customers'])
+    assert customers['CustomerID'].nunique() == 300 and customers['CustomerID'].duplicated().any()
+    assert customers['Region'].str.strip().isin(PROVINCE_CODES).any()
+    repayment_ids = pd.concat(pd.read_csv(path) for path in resolve_files(first['repayments']))['RepaymentID']
+    assert repayment_ids.tolist() == list(range(1, 2001))
+
+    # A directory the generator did not write is never emptied
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "keep.csv").write_text("kept")
+    with pytest.raises(FileExistsError):
+        benchmark.generate_dataset(str(tmp_path / "other"), n_customers=10, n_repayments=10)
+    assert (tmp_path / "other" / "keep.csv").exists()
+
+
+def test_benchmark_runs_writing_questions_once(tmp_path, monkeypatch):
+    runs = Counter()
+
+    def counted_run_query(qry, cursor, cache):
+        runs[qry] += 1
+        return run_query(qry, cursor, cache)
+
+    monkeypatch.setattr(benchmark, "run_query", counted_run_query)
+    results = benchmark.run_benchmark(300, 2000, repeat=2, output_dir=str(tmp_path / "benchmark"))
+
+    assert [result["stage"] for result in results] == ["generate", "load"] + [name for name, _ in discover_questions()]
+    assert runs[sql.question_5()] == 1
+    assert runs[sql.question_1()] == 2
+    with duckdb.connect(str(tmp_path / "benchmark" / "loan.db")) as cursor:
+        # SQL.question_5 ran once and credit_clean was refreshed from the updated credit table
+        assert cursor.execute("SELECT COUNT(*) FROM credit_clean WHERE CustomerClass = 'C'").fetchone()[0] > 0
+        assert cursor.execute("""SELECT COUNT(*) FROM credit_clean c JOIN credit r USING (CustomerID)
+                              WHERE c.CustomerClass <> trim(r.CustomerClass)""").fetchone()[0] == 0
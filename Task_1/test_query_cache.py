@@ -0,0 +1,198 @@
+import json
+import shutil
+import threading
+import time
+
+import duckdb
+import pytest
+
+import Advanced_SQL as asql
+import SQL as sql
+import batch_runner
+from batch_runner import discover_questions, plan_questions, run_questions
+from database.database_load import database_path, execute_statements, refresh_derived_tables
+from profiler import profile_questions, write_profiles
+from query_cache import QueryCache, normalize_sql, run_query, split_statements, written_tables
+
+"""
+Tests for the query cache, batch runner and profiler, run against copies of loan.db so the committed database is not
+changed.
+
+"""
+
+
+@pytest.fixture
+def loan_db(tmp_path):
+    path = str(tmp_path / "loan.db")
+    shutil.copy(database_path, path)
+    with duckdb.connect(path) as cursor:
+        refresh_derived_tables(cursor)
+    return path
+
+
+def test_read_only_queries_are_cached(loan_db):
+    cache = QueryCache()
+    with duckdb.connect(loan_db) as cursor:
+        first = run_query(sql.question_1(), cursor, cache)
+        second = run_query(sql.question_1(), cursor, cache)
+
+    assert second is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_with_insert_is_a_write(loan_db):
+    qry = "WITH first_month AS (SELECT * FROM months LIMIT 1) INSERT INTO months SELECT * FROM first_month"
+    version_qry = "SELECT Version FROM table_versions WHERE TableName = 'months'"
+    cache = QueryCache()
+    with duckdb.connect(loan_db) as cursor:
+        rows = cursor.execute("SELECT COUNT(*) FROM months").fetchone()[0]
+        version = cursor.execute(version_qry).fetchone()[0]
+        run_query(qry, cursor, cache)
+        run_query(qry, cursor, cache)
+
+        assert cursor.execute("SELECT COUNT(*) FROM months").fetchone()[0] == rows + 2
+        assert cursor.execute(version_qry).fetchone()[0] == version + 2
+    assert len(cache) == 0
+
+
+def test_database_copies_do_not_share_results(loan_db, tmp_path):
+    other_db = str(tmp_path / "other.db")
+    shutil.copy(loan_db, other_db)
+    cache = QueryCache()
+    with duckdb.connect(loan_db) as cursor, duckdb.connect(other_db) as other:
+        other.execute("DELETE FROM months WHERE MonthID > 6")
+        assert run_query("SELECT COUNT(*) AS n FROM months", cursor, cache)["n"][0].as_py() == 12
+        assert run_query("SELECT COUNT(*) AS n FROM months", other, cache)["n"][0].as_py() == 6
+
+
+def test_credit_update_refreshes_credit_clean(loan_db):
+    cache = QueryCache()
+    with duckdb.connect(loan_db) as cursor:
+        before = run_query(asql.question_1(), cursor, cache)
+        run_query(sql.question_5(), cursor, cache)
+        after = run_query(asql.question_1(), cursor, cache)
+
+        # credit_clean is rebuilt from the updated credit table and the cached result is not reused
+        assert cursor.execute("SELECT * FROM credit_clean EXCEPT SELECT * FROM credit").fetchall() == []
+    assert not after.equals(before)
+    assert cache.hits == 0
+
+
+def test_repayments_insert_refreshes_repayment_summary(loan_db):
+    summary_qry = "SELECT * FROM repayment_summary ORDER BY CustomerID, MonthID"
+    version_qry = "SELECT Version FROM table_versions WHERE TableName = 'repayment_summary'"
+    cache = QueryCache()
+    with duckdb.connect(loan_db) as cursor:
+        before = run_query("SELECT * FROM repayment_pivot ORDER BY CustomerID", cursor, cache)
+        summary = cursor.execute(summary_qry).fetchall()
+        version = cursor.execute(version_qry).fetchone()[0]
+        run_query("""INSERT INTO repayments (RepaymentID, CustomerID, RepaymentDate, TimeZone, Amount)
+                  SELECT RepaymentID + 1000000, CustomerID, RepaymentDate, TimeZone, Amount FROM repayments""",
+                  cursor, cache)
+        after = run_query("SELECT * FROM repayment_pivot ORDER BY CustomerID", cursor, cache)
+
+        # Every repayment was inserted a second time, so every customer-month counts twice
+        doubled = [(customer, month, 2 * count, 2 * total) for customer, month, count, total in summary]
+        assert cursor.execute(summary_qry).fetchall() == doubled
+        assert cursor.execute(version_qry).fetchone()[0] > version
+    assert not after.equals(before)
+    assert cache.hits == 0
+
+
+def test_credit_readers_wait_for_the_credit_writer(loan_db):
+    with duckdb.connect(loan_db) as cursor:
+        plan = {task["name"]: task for task in plan_questions(cursor, discover_questions())}
+
+    assert "credit_clean" in plan["SQL.question_5"]["writes"]
+    assert "SQL.question_5" in plan["Advanced_SQL.question_1"]["depends_on"]
+
+
+def test_threaded_results_match_serial_and_writes_are_serialized(loan_db, tmp_path, monkeypatch):
+    serial_db = str(tmp_path / "serial.db")
+    shutil.copy(loan_db, serial_db)
+    serial = run_questions(database=serial_db, n_workers=1, cache=None)
+
+    lock = threading.Lock()
+    running_writes = []
+    write_order = []
+    max_running_writes = []
+
+    def tracked_run_query(qry, cursor, cache):
+        is_write = written_tables(split_statements(normalize_sql(qry))) is not None
+        if is_write:
+            with lock:
+                running_writes.append(qry)
+                write_order.append(qry)
+                max_running_writes.append(len(running_writes))
+        try:
+            time.sleep(0.01)
+            return run_query(qry, cursor, cache)
+        finally:
+            if is_write:
+                with lock:
+                    running_writes.remove(qry)
+
+    monkeypatch.setattr(batch_runner, "run_query", tracked_run_query)
+    threaded = run_questions(database=loan_db, n_workers=4, cache=None)
+
+    assert list(threaded) == list(serial)
+    for name, df_result in serial.items():
+        assert threaded[name].equals(df_result), name
+    assert max(max_running_writes) == 1
+    declared = [question() for _, question in discover_questions()]
+    assert write_order == [qry for qry in declared if written_tables(split_statements(normalize_sql(qry))) is not None]
+
+
+def test_profile_json_has_per_statement_timings(loan_db, tmp_path):
+    profiles = profile_questions([("SQL.question_1", sql.question_1)], database=loan_db, repeat=2)
+    write_profiles(profiles, str(tmp_path))
+    with open(tmp_path / "profile.json") as f:
+        (profile,) = json.load(f)
+
+    (statement,) = profile["statements"]
+    assert profile["question"] == "SQL.question_1"
+    assert set(statement) == {"sql", "seconds", "rows", "peak_memory_bytes", "operators", "plan"}
+    assert statement["seconds"] > 0 and statement["peak_memory_bytes"] >= 0
+    with duckdb.connect(loan_db) as cursor:
+        assert statement["rows"] == run_query(sql.question_1(), cursor, None).num_rows
+    assert statement["operators"] and {"operator", "depth", "seconds", "rows"} <= set(statement["operators"][0])
+    assert (tmp_path / "summary.txt").read_text().strip()
+
+
+def test_missing_derived_tables_are_built(loan_db):
+    expected = run_questions(database=loan_db, cache=None)
+
+    # A loan.db from an older loader has none of the derived tables
+    shutil.copy(database_path, loan_db)
+    with duckdb.connect(loan_db) as cursor:
+        cursor.execute("DROP VIEW IF EXISTS repayment_pivot")
+        for table in ("repayment_summary", "customers_clean", "credit_clean", "province_codes", "table_versions"):
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+    results = run_questions(database=loan_db, cache=None)
+    for name, df_result in expected.items():
+        assert results[name].equals(df_result), name
+
+
+def test_prepare_database_builds_the_derived_tables(tmp_path):
+    path = str(tmp_path / "loan.db")
+    shutil.copy(database_path, path)
+    asql.prepare_database(path)
+
+    with duckdb.connect(path) as cursor:
+        execute_statements(cursor, asql.question_4())
+        assert cursor.execute("SELECT COUNT(*) FROM timeline WHERE CustomerID = 1").fetchone()[0] == 12
+        assert cursor.execute("SELECT COUNT(*) FROM repayments WHERE RepaymentMonth IS NULL").fetchone()[0] == 0
+
+
+def test_reads_without_versions_do_not_write(loan_db):
+    with duckdb.connect(loan_db) as cursor:
+        cursor.execute("CREATE TABLE unversioned AS SELECT * FROM months")
+
+    cache = QueryCache()
+    with duckdb.connect(loan_db, read_only=True) as cursor:
+        first = run_query("SELECT COUNT(*) AS n FROM unversioned", cursor, cache)
+        run_query("SELECT COUNT(*) AS n FROM unversioned", cursor, cache)
+
+    assert first["n"][0].as_py() == 12
+    assert len(cache) == 0
@@ -1,7 +1,12 @@
+import hashlib
+import json
 import os
+from functools import cached_property
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 """
 To answer the following questions, make use of datasets: 
@@ -20,6 +25,9 @@ Note: Do not round any final answers.
 
 """
 
+# Monthly interest rate for the 10% annual rate
+R_MONTHLY = 0.1 / 12
+
 
 def calculate_df_balances(df_scheduled, df_actual):
     """
@@ -78,17 +86,638 @@ def calculate_df_balances(df_scheduled, df_actual):
     return df_balances
 
 
-# Do not edit these directories
-root = os.getcwd()
+def loan_month_positions(loan_ids):
+    """
+    Position of every row in a (loans x months) grid, for non-empty rows sorted by LoanID and Month.
+
+    Args:
+        loan_ids (ndarray): LoanID of every row, with each loan's rows contiguous and in month order
+
+    Returns:
+        tuple: (is_first_month, loan_idx, month_idx) arrays aligned with the rows.
+
+    """
+
+    is_first_month = np.empty(len(loan_ids), dtype=bool)
+    is_first_month[0] = True
+    is_first_month[1:] = loan_ids[1:] != loan_ids[:-1]
+    loan_idx = np.cumsum(is_first_month) - 1
+    month_idx = np.arange(len(loan_ids)) - np.flatnonzero(is_first_month)[loan_idx]
+    return is_first_month, loan_idx, month_idx
+
+
+def amortize_arrays(loan_ids, repayments, opening_balances, r_monthly, term_months=None):
+    """
+    Amortize loans given as flat arrays of rows sorted by LoanID and Month.
+
+    Loans are laid out as rows of a (loans x months) NumPy array so each month is a single
+    array operation over the whole portfolio. Rates and terms can differ per loan, in which
+    case they are applied as per loan vectors. When every loan shares the same rate the
+    scalar path is used, and terms are only applied when a loan runs past its term.
+
+    A loan's term is the period its rate is contracted for: the scheduled repayments amortize
+    the loan at that rate over the term. Past its term, a remaining balance is an arrear that
+    is collected without further contractual interest, so the rate drops to 0. Without terms,
+    like 'calculate_df_balances()', interest is charged on every month.
+
+    Args:
+        loan_ids (ndarray): LoanID of every row, with each loan's rows contiguous and in month order
+        repayments (ndarray): ActualRepayment of every row
+        opening_balances (ndarray): Balance each loan starts from, read on the first row of every loan
+        r_monthly (float or ndarray): Monthly interest rate, or the rate of every row, read on the first row of
+            every loan
+        term_months (ndarray): Months left in the term from each loan's first row, read on that row, None for no term.
+            Interest stops accruing once a loan is past its term.
+
+    Returns:
+        tuple: Unrounded (LoanBalanceStart, LoanBalanceEnd, InterestPayment) arrays aligned with the rows.
+
+    """
+
+    n_rows = len(loan_ids)
+    if n_rows == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+
+    is_first_month, loan_idx, month_idx = loan_month_positions(loan_ids)
+    n_loans = loan_idx[-1] + 1
+    n_months = month_idx.max() + 1
+
+    repayment_grid = np.zeros((n_loans, n_months))
+    repayment_grid[loan_idx, month_idx] = repayments
+
+    start_balances = np.zeros((n_loans, n_months))
+    start_balances[:, 0] = opening_balances[is_first_month]
+
+    end_balances = np.zeros((n_loans, n_months))
+    interest_payments = np.zeros((n_loans, n_months))
+
+    # Per loan rates, collapsed to a scalar when the whole portfolio shares one rate
+    r_monthly = np.asarray(r_monthly, dtype=float)
+    if r_monthly.ndim:
+        r_monthly = r_monthly[is_first_month]
+        if (r_monthly == r_monthly[0]).all():
+            r_monthly = r_monthly[0]
+
+    # Per loan terms, only needed when some loan has rows past its term
+    loan_terms = None
+    if term_months is not None:
+        loan_terms = np.asarray(term_months)[is_first_month]
+        if (loan_terms >= n_months).all():
+            loan_terms = None
+
+    # Step through the months, amortizing all loans at once
+    for month in range(n_months):
+        if month > 0:
+            start_balances[:, month] = end_balances[:, month - 1]
+        month_rate = r_monthly if loan_terms is None else np.where(month < loan_terms, r_monthly, 0.0)
+        interest_payments[:, month] = start_balances[:, month] * month_rate
+        new_balance = (start_balances[:, month] + interest_payments[:, month]) - repayment_grid[:, month]
+
+        # Same semantics as max(0, new_balance), including NaN -> 0
+        end_balances[:, month] = np.where(new_balance > 0, new_balance, 0.0)
+
+    return (
+        start_balances[loan_idx, month_idx],
+        end_balances[loan_idx, month_idx],
+        interest_payments[loan_idx, month_idx],
+    )
+
+
+def add_balance_columns(df_balances, loan_balance_start, loan_balance_end, interest_payment):
+    """
+    Add the rounded LoanBalanceStart, LoanBalanceEnd and InterestPayment columns to a merged frame in place.
+    """
+
+    df_balances["LoanBalanceStart"] = loan_balance_start
+    df_balances["LoanBalanceEnd"] = loan_balance_end
+    df_balances["InterestPayment"] = interest_payment
+
+    df_balances["LoanBalanceEnd"] = df_balances["LoanBalanceEnd"].round(2)
+    df_balances["InterestPayment"] = df_balances["InterestPayment"].round(2)
+    df_balances["LoanBalanceStart"] = df_balances["LoanBalanceStart"].round(2)
+
+
+def loan_rates_and_terms(df_balances, r_monthly=R_MONTHLY, rate_column=None, term_column=None):
+    """
+    Per row monthly rate and remaining term of a merged frame sorted by LoanID and Month, for 'amortize_arrays()'.
+
+    Args:
+        df_balances (DataFrame): Merged repayments, with the rate and term columns of df_scheduled
+        r_monthly (float): Monthly interest rate of every loan when there is no rate column
+        rate_column (str): Column with the annual interest rate of every loan in percent, like `InterestRate`
+            in Task_1's loans table
+        term_column (str): Column with the term of every loan in months, like `LoanTerm` in Task_1's loans table
+
+    Returns:
+        tuple: (r_monthly, term_months), r_monthly as a float or per row array and term_months as a per row array
+            of the months left in the term from each loan's first row, or None without a term column.
+
+    """
+
+    if rate_column is not None:
+        r_monthly = df_balances[rate_column].to_numpy(dtype=float) / 100 / 12
+
+    term_months = None
+    if term_column is not None and len(df_balances):
+        # A batch can start mid-term, so count the term from the Month of each loan's first row
+        months = df_balances["Month"].to_numpy()
+        is_first_month, loan_idx, _ = loan_month_positions(df_balances["LoanID"].to_numpy())
+        term_months = df_balances[term_column].to_numpy() - (months[is_first_month][loan_idx] - 1)
+
+    return r_monthly, term_months
+
+
+def _amortize_sorted(df_balances, opening_balances, r_monthly, rate_column=None, term_column=None):
+    """
+    Amortize a merged frame sorted by LoanID and Month, adding the balance columns in place.
+
+    Returns the unrounded LoanBalanceEnd of every row, the state 'update_df_balances()' continues from.
+    """
+
+    balances = amortize_arrays(
+        df_balances["LoanID"].to_numpy(),
+        df_balances["ActualRepayment"].to_numpy(dtype=float),
+        opening_balances,
+        *loan_rates_and_terms(df_balances, r_monthly, rate_column, term_column),
+    )
+    add_balance_columns(df_balances, *balances)
+    return balances[1]
+
+
+def calculate_df_balances_vectorized(df_scheduled, df_actual, r_monthly=R_MONTHLY, rate_column=None, term_column=None):
+    """
+    Vectorized equivalent of 'calculate_df_balances()' that amortizes every loan at once.
+
+    Each month is a single array operation over the whole portfolio, instead of an iterrows() walk per loan.
+    The output matches 'calculate_df_balances()' row for row, including the zero clamp and rounding.
+    Portfolios that mix rates and terms are amortized in the same pass from per loan columns of df_scheduled.
+
+    Args:
+        df_scheduled (DataFrame): Dataframe created from the 'scheduled_loan_repayments.csv' dataset
+        df_actual (DataFrame): Dataframe created from the 'actual_loan_repayments.csv' dataset
+        r_monthly (float): Monthly interest rate, defaults to 10% per annum
+        rate_column (str): Column of df_scheduled with each loan's annual interest rate in percent, overrides r_monthly
+        term_column (str): Column of df_scheduled with each loan's term in months
+
+    Returns:
+        DataFrame: A merged Dataframe with additional calculated columns to help with the following questions.
+
+    """
+
+    # Merge and order rows the same way groupby("LoanID").apply(...sort_values("Month")) does
+    df_balances = pd.merge(df_actual, df_scheduled)
+    df_balances = df_balances.sort_values(["LoanID", "Month"], kind="mergesort").reset_index(drop=True)
+
+    # Opening balance of each loan is the LoanAmount on its first row
+    _amortize_sorted(df_balances, df_balances["LoanAmount"].to_numpy(dtype=float), r_monthly, rate_column, term_column)
+
+    return df_balances
+
+
+def last_loan_balances(df_balances, loan_balance_end=None):
+    """
+    Extract the latest Month and LoanBalanceEnd of every loan, the state needed for incremental updates.
+
+    The LoanBalanceEnd column of a balances frame is rounded to cents, and continuing from it drifts from a full
+    recompute by a few cents over many months. Pass the unrounded balances to get an exact state, or use the state
+    returned by 'update_df_balances()'.
+
+    Args:
+        df_balances (DataFrame): Balances from 'calculate_df_balances_vectorized()' or 'update_df_balances()',
+            or a previous state frame concatenated with new balances
+        loan_balance_end (ndarray): Unrounded LoanBalanceEnd aligned with the rows, defaults to the LoanBalanceEnd
+            column
+
+    Returns:
+        DataFrame: One row per LoanID with columns `LoanID`, `Month` and `LoanBalanceEnd`, sorted by LoanID.
+
+    """
+
+    df_last = df_balances[["LoanID", "Month", "LoanBalanceEnd"]]
+    if loan_balance_end is not None:
+        df_last = df_last.assign(LoanBalanceEnd=loan_balance_end)
+    df_last = df_last.sort_values(["LoanID", "Month"], kind="mergesort")
+    return df_last.drop_duplicates("LoanID", keep="last").reset_index(drop=True)
 
-if "Task_2" in root:
-    df_scheduled = pd.read_csv("data/scheduled_loan_repayments.csv")
-    df_actual = pd.read_csv("data/actual_loan_repayments.csv")
-else:
-    df_scheduled = pd.read_csv("Task_2/data/scheduled_loan_repayments.csv")
-    df_actual = pd.read_csv("Task_2/data/actual_loan_repayments.csv")
 
-df_balances = calculate_df_balances(df_scheduled, df_actual)
+def update_df_balances(
+    df_scheduled, df_new_actual, df_last_balances, r_monthly=R_MONTHLY, rate_column=None, term_column=None
+):
+    """
+    Amortize only a batch of newly arrived repayments, continuing from each loan's last persisted balance.
+
+    The cost is proportional to the batch, not to the loans' full history. Loans without a persisted
+    balance start from their LoanAmount. The returned state keeps the unrounded balances, so batches
+    chained through it give the same balances as a full recompute, to the cent.
+
+    Args:
+        df_scheduled (DataFrame): Dataframe created from the 'scheduled_loan_repayments.csv' dataset
+        df_new_actual (DataFrame): New rows shaped like the 'actual_loan_repayments.csv' dataset
+        df_last_balances (DataFrame): State returned by the previous batch, or 'last_loan_balances()' of the
+            already processed months, None when no month has been processed yet
+        r_monthly (float): Monthly interest rate, defaults to 10% per annum
+        rate_column (str): Column of df_scheduled with each loan's annual interest rate in percent, overrides r_monthly
+        term_column (str): Column of df_scheduled with each loan's term in months
+
+    Returns:
+        tuple: (df_balances, df_last_balances), the balances for the new rows only, with the same columns as
+            'calculate_df_balances_vectorized()', and the state to pass to the next batch.
+
+    Raises:
+        ValueError: If the batch contains a month that is not after the loan's last persisted month.
+
+    """
+
+    df_balances = pd.merge(df_new_actual, df_scheduled)
+    df_balances = df_balances.sort_values(["LoanID", "Month"], kind="mergesort").reset_index(drop=True)
+
+    if df_last_balances is None:
+        df_last_balances = last_loan_balances(df_balances.iloc[:0].assign(LoanBalanceEnd=0.0))
+    df_last = df_last_balances.set_index("LoanID")
+    last_month = df_balances["LoanID"].map(df_last["Month"])
+    stale = df_balances["Month"] <= last_month
+    if stale.any():
+        raise ValueError(
+            f"{int(stale.sum())} repayment rows are not after the last persisted month of their loan"
+        )
+
+    # Continue from the persisted balance, or start from LoanAmount for loans seen for the first time
+    opening_balances = df_balances["LoanID"].map(df_last["LoanBalanceEnd"]).fillna(df_balances["LoanAmount"])
+    loan_balance_end = _amortize_sorted(
+        df_balances, opening_balances.to_numpy(dtype=float), r_monthly, rate_column, term_column
+    )
+
+    # Loans missing from the batch keep their previous state
+    df_new_last = last_loan_balances(df_balances, loan_balance_end)
+    df_last_balances = last_loan_balances(pd.concat([df_last_balances, df_new_last], ignore_index=True))
+
+    return df_balances, df_last_balances
+
+
+# Data paths are resolved relative to this file, so the working directory does not matter
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+SCHEDULED_CSV = os.path.join(DATA_DIR, "scheduled_loan_repayments.csv")
+ACTUAL_CSV = os.path.join(DATA_DIR, "actual_loan_repayments.csv")
+
+# Persistent Parquet cache of the computed balances
+CACHE_DIR = os.path.join(DATA_DIR, ".cache")
+
+# Memoized datasets, keyed by name: {"files": {path: (mtime_ns, size, sha256)}, "value": DataFrame}
+_dataset_cache = {}
+
+
+def _file_hash(path):
+    """
+    Return the sha256 hex digest of a file, read in 1 MiB blocks.
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_fingerprint(path, previous=None):
+    """
+    Return a (mtime_ns, size, sha256) fingerprint for a file.
+
+    The file is only re-hashed when its mtime or size differ from the previous fingerprint,
+    so an unchanged file costs a single stat() call.
+    """
+
+    stat = os.stat(path)
+    if previous is not None and previous[:2] == (stat.st_mtime_ns, stat.st_size):
+        return previous
+    return (stat.st_mtime_ns, stat.st_size, _file_hash(path))
+
+
+def _load_cached(name, paths, build):
+    """
+    Return the memoized value for 'name', rebuilding it when any source file's contents changed.
+
+    A touched file whose hash is unchanged only refreshes the stored fingerprint.
+
+    Args:
+        name (str): Cache key of the dataset
+        paths (list): Source files the dataset is built from
+        build (callable): Builds the dataset, called with the {path: (mtime_ns, size, sha256)} fingerprints
+
+    Returns:
+        The cached or freshly built value.
+
+    """
+
+    entry = _dataset_cache.get(name)
+    previous = entry["files"] if entry else {}
+    files = {path: _file_fingerprint(path, previous.get(path)) for path in paths}
+
+    if entry is None or [f[2] for f in files.values()] != [previous[p][2] for p in files]:
+        entry = {"files": files, "value": build(files)}
+        _dataset_cache[name] = entry
+    else:
+        entry["files"] = files
+
+    return entry["value"]
+
+
+def load_scheduled():
+    """
+    Lazily load the 'scheduled_loan_repayments.csv' dataset.
+
+    The returned Dataframe is shared between callers, copy it before modifying it.
+
+    Returns:
+        DataFrame: The scheduled repayments.
+
+    """
+
+    return _load_cached("df_scheduled", [SCHEDULED_CSV], lambda files: pd.read_csv(SCHEDULED_CSV))
+
+
+def load_actual():
+    """
+    Lazily load the 'actual_loan_repayments.csv' dataset.
+
+    The returned Dataframe is shared between callers, copy it before modifying it.
+
+    Returns:
+        DataFrame: The actual repayments.
+
+    """
+
+    return _load_cached("df_actual", [ACTUAL_CSV], lambda files: pd.read_csv(ACTUAL_CSV))
+
+
+def balances_cache_key(source_hashes, r_monthly=R_MONTHLY):
+    """
+    Build the Parquet cache key for a balances frame.
+
+    Args:
+        source_hashes (list): sha256 digests of the scheduled and actual repayment files, in that order
+        r_monthly (float): Monthly interest rate used for the amortization
+
+    Returns:
+        str: A sha256 hex digest identifying the balances frame.
+
+    """
+
+    payload = json.dumps({"sources": list(source_hashes), "r_monthly": repr(r_monthly)})
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def current_balances_cache_key(r_monthly=R_MONTHLY):
+    """
+    Return the 'balances_cache_key()' of the repayment datasets as they are on disk now.
+
+    Files are only re-hashed when their mtime or size changed since 'load_balances()' last read them.
+    """
+
+    entry = _dataset_cache.get("df_balances")
+    previous = entry["files"] if entry else {}
+    hashes = [_file_fingerprint(path, previous.get(path))[2] for path in (SCHEDULED_CSV, ACTUAL_CSV)]
+    return balances_cache_key(hashes, r_monthly)
+
+
+def _balances_cache_path(key, cache_dir=None):
+    return os.path.join(cache_dir or CACHE_DIR, f"balances-{key}.parquet")
+
+
+def read_balances_cache(key, cache_dir=None):
+    """
+    Read a cached balances frame, memory-mapping the Parquet file.
+
+    Args:
+        key (str): Key from 'balances_cache_key()'
+        cache_dir (str): Directory holding the cache files, 'CACHE_DIR' by default
+
+    Returns:
+        DataFrame: The cached balances, or None if there is no cache file for the key.
+
+    """
+
+    path = _balances_cache_path(key, cache_dir)
+    if not os.path.exists(path):
+        return None
+    return pq.read_table(path, memory_map=True).to_pandas()
+
+
+def write_balances_cache(df_balances, key, cache_dir=None):
+    """
+    Write a balances frame to the Parquet cache, replacing the cache files of older keys.
+
+    The file is written to a temporary name and renamed, so readers never see a partial file.
+
+    Args:
+        df_balances (DataFrame): Output of 'calculate_df_balances_vectorized()'
+        key (str): Key from 'balances_cache_key()'
+        cache_dir (str): Directory holding the cache files, 'CACHE_DIR' by default
+
+    Returns:
+        str: Path of the written Parquet file.
+
+    """
+
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _balances_cache_path(key, cache_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(pa.Table.from_pandas(df_balances), tmp_path)
+    os.replace(tmp_path, path)
+
+    # Only the latest inputs are worth keeping
+    for filename in os.listdir(cache_dir):
+        stale = os.path.join(cache_dir, filename)
+        if filename.startswith("balances-") and filename.endswith(".parquet") and stale != path:
+            os.remove(stale)
+
+    return path
+
+
+def _build_balances(files, use_disk_cache):
+    """
+    Build the balances frame, going through the Parquet cache when enabled.
+    """
+
+    if not use_disk_cache:
+        return calculate_df_balances_vectorized(load_scheduled(), load_actual())
+
+    key = balances_cache_key([files[SCHEDULED_CSV][2], files[ACTUAL_CSV][2]])
+    df_balances = read_balances_cache(key)
+    if df_balances is None:
+        df_balances = calculate_df_balances_vectorized(load_scheduled(), load_actual())
+        write_balances_cache(df_balances, key)
+
+    return df_balances
+
+
+def load_balances(use_disk_cache=True):
+    """
+    Lazily build the balances Dataframe from the two repayment datasets.
+
+    With 'use_disk_cache' the frame is read from the Parquet cache in 'CACHE_DIR' when the
+    input files and interest rate are unchanged, skipping the CSV reads and the amortization.
+    The returned Dataframe is shared between callers, copy it before modifying it.
+
+    Args:
+        use_disk_cache (bool): Read and write the Parquet cache of the balances
+
+    Returns:
+        DataFrame: The output of 'calculate_df_balances_vectorized()' on the repayment datasets.
+
+    """
+
+    return _load_cached(
+        "df_balances",
+        [SCHEDULED_CSV, ACTUAL_CSV],
+        lambda files: _build_balances(files, use_disk_cache),
+    )
+
+
+def clear_dataset_cache():
+    """
+    Drop all memoized datasets so the next access reloads them from disk.
+    """
+
+    _dataset_cache.clear()
+
+
+_lazy_datasets = {
+    "df_scheduled": load_scheduled,
+    "df_actual": load_actual,
+    "df_balances": load_balances,
+}
+
+
+def __getattr__(name):
+    # Keep 'Python.df_scheduled', 'Python.df_actual' and 'Python.df_balances' working, built on first access
+    if name in _lazy_datasets:
+        return _lazy_datasets[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class PortfolioMetrics:
+    """
+    Portfolio risk metrics computed from a single grouped pass over the balances.
+
+    The constructor reads every column once and aggregates it per loan-year and per month with
+    np.bincount. The metrics are derived from those aggregates on first access and memoized, so
+    a full risk report costs one scan and no copy of the balances.
+
+    Args:
+        df_balances (DataFrame): Dataframe created from the 'calculate_df_balances()' function
+        recovery_rate (float): Recovery rate used for the expected loss
+
+    """
+
+    def __init__(self, df_balances, recovery_rate=0.8):
+        self.recovery_rate = recovery_rate
+
+        months = df_balances["Month"].to_numpy()
+        actual = df_balances["ActualRepayment"].to_numpy(dtype=float)
+        scheduled = df_balances["ScheduledRepayment"].to_numpy(dtype=float)
+
+        loan_idx, self.loan_ids = pd.factorize(df_balances["LoanID"], sort=True)
+        n_loans = len(self.loan_ids)
+
+        # Per loan-year totals, laid out as (loans x years) arrays
+        year_idx = (months - 1) // 12
+        n_years = year_idx.max() + 1 if len(year_idx) else 0
+        loan_year = loan_idx * n_years + year_idx
+        size = n_loans * n_years
+        self._months_per_year = np.bincount(loan_year, minlength=size).reshape(n_loans, n_years)
+        self._expected_per_year = np.bincount(loan_year, weights=scheduled, minlength=size).reshape(n_loans, n_years)
+        self._actual_per_year = np.bincount(loan_year, weights=actual, minlength=size).reshape(n_loans, n_years)
+
+        # Loans with any repayment short of the schedule
+        self._missed_payment = np.bincount(loan_idx, weights=actual < scheduled, minlength=n_loans) > 0
+
+        # Portfolio totals per month, indexed by Month
+        n_months = months.max() + 1 if len(months) else 0
+        self._start_per_month = np.bincount(
+            months, weights=df_balances["LoanBalanceStart"].to_numpy(dtype=float), minlength=n_months
+        )
+        self._actual_per_month = np.bincount(months, weights=actual, minlength=n_months)
+        self._scheduled_per_month = np.bincount(months, weights=scheduled, minlength=n_months)
+        self._has_month = np.bincount(months, minlength=n_months) > 0
+
+        self._year_end_exposure = df_balances["LoanBalanceEnd"].to_numpy(dtype=float)[months == 12].sum()
+
+    @cached_property
+    def type_1_default_rate(self):
+        """
+        float: Percent of loans with any scheduled repayment not met in full, see 'question_1()'.
+        """
+
+        return (self._missed_payment.sum() / len(self.loan_ids)) * 100
+
+    @cached_property
+    def type_2_defaults(self):
+        """
+        ndarray: Per loan, aligned with 'loan_ids', whether more than 15% of a full year's payments were unpaid.
+        """
+
+        full_year = self._months_per_year == 12
+        return (full_year & (self._actual_per_year < 0.85 * self._expected_per_year)).any(axis=1)
+
+    @cached_property
+    def type_2_default_rate(self):
+        """
+        float: Percent of loans with at least one full year that had a type 2 default, see 'question_2()'.
+        """
+
+        has_full_year = (self._months_per_year == 12).any(axis=1)
+        return 100.0 * self.type_2_defaults.sum() / has_full_year.sum()
+
+    @cached_property
+    def smm(self):
+        """
+        Series: Portfolio SMM for months 1 to 12 with a positive start balance, indexed by Month.
+        """
+
+        months = np.flatnonzero(self._has_month)
+        months = months[(months >= 1) & (months <= 12) & (self._start_per_month[months] > 0)]
+        unscheduled_principal = np.clip(self._actual_per_month[months] - self._scheduled_per_month[months], 0, None)
+        return pd.Series(unscheduled_principal / self._start_per_month[months], index=pd.Index(months, name="Month"))
+
+    @cached_property
+    def cpr(self):
+        """
+        float: Annualised CPR percent from the geometric mean SMM, see 'question_3()'.
+        """
+
+        smm_mean = (np.prod(1 + self.smm) ** (1 / 12)) - 1
+        return (1 - (1 - smm_mean) ** 12) * 100
+
+    @cached_property
+    def year_end_exposure(self):
+        """
+        float: Total LoanBalanceEnd at the end of month 12, the exposure entering year 2.
+        """
+
+        return self._year_end_exposure
+
+    @cached_property
+    def expected_loss(self):
+        """
+        float: Predicted year 2 loss from the type 2 default rate and the year-end exposure, see 'question_4()'.
+        """
+
+        probability_of_default = self.type_2_default_rate / 100.0
+        return probability_of_default * self.year_end_exposure * (1.0 - self.recovery_rate)
+
+    def as_dict(self):
+        """
+        Return the scalar metrics as a dictionary, computing any that are still missing.
+        """
+
+        return {
+            "type_1_default_rate": self.type_1_default_rate,
+            "type_2_default_rate": self.type_2_default_rate,
+            "cpr": self.cpr,
+            "year_end_exposure": self.year_end_exposure,
+            "expected_loss": self.expected_loss,
+        }
 
 
 def question_1(df_balances):
@@ -221,13 +850,12 @@ def question_4(df_balances):
 
     recovery_rate = 0.8
 
-    # Use Type 2 default probability as it is a more meaningful severity-based metric
-    probability_of_default = question_2(df_scheduled, df_balances) / 100.0
-
-    # Exposure entering Year 2 = total balance at end of Month 12 (end of Year 1)
-    exposure_start_year_2 = df_balances.loc[df_balances["Month"] == 12, "LoanBalanceEnd"].sum()
+    # Use Type 2 default probability as it is a more meaningful severity-based metric.
+    # The default rate and the exposure entering Year 2 (total balance at end of Month 12)
+    # come from one pass over df_balances instead of rerunning question_2.
+    metrics = PortfolioMetrics(df_balances, recovery_rate=recovery_rate)
 
     # Calculate total loss
-    total_loss = probability_of_default * exposure_start_year_2 * (1.0 - recovery_rate)
+    total_loss = metrics.expected_loss
 
     return total_loss
@@ -0,0 +1,212 @@
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import Python as py
+
+"""
+Benchmark suite for the Task_2 pipeline.
+
+'generate_portfolio()' builds seeded data shaped like 'scheduled_loan_repayments.csv' and
+'actual_loan_repayments.csv' at any scale. The rates of missed months, prepayments and defaults
+default to what the sample files show: about 94% of loan-months are paid exactly as scheduled,
+1.4% are missed and 5% pay double the scheduled amount.
+
+'run_benchmark()' times every stage of the pipeline and records its peak traced memory. Run
+'python benchmark.py --sizes 10000 100000 --output results.json' to write machine-readable results
+that can be compared between versions.
+
+"""
+
+# Loan term and amount range of the sample portfolio
+TERM_MONTHS = 24
+LOAN_AMOUNTS = np.arange(13_000, 121_000, 1_000)
+
+
+def generate_portfolio(
+    n_loans,
+    n_months=12,
+    seed=0,
+    missed_rate=0.014,
+    prepayment_rate=0.05,
+    default_rate=0.01,
+):
+    """
+    Generate a seeded synthetic portfolio.
+
+    Args:
+        n_loans (int): Number of loans
+        n_months (int): Number of months of actual repayments per loan
+        seed (int): Seed of the random generator, the same seed always gives the same portfolio
+        missed_rate (float): Probability that a loan-month is not paid at all
+        prepayment_rate (float): Probability that a loan-month pays double the scheduled amount
+        default_rate (float): Probability that a loan stops paying from a random month onwards
+
+    Returns:
+        tuple: (df_scheduled, df_actual) with the same columns and dtypes as the CSV datasets.
+
+    """
+
+    rng = np.random.default_rng(seed)
+
+    # Scheduled annuity repayment of a 2 year loan at 10% per annum
+    loan_ids = np.arange(1, n_loans + 1)
+    loan_amounts = rng.choice(LOAN_AMOUNTS, size=n_loans).astype(float)
+    annuity_factor = py.R_MONTHLY / (1 - (1 + py.R_MONTHLY) ** -TERM_MONTHS)
+    scheduled_repayments = np.round(loan_amounts * annuity_factor, 2)
+
+    df_scheduled = pd.DataFrame(
+        {
+            "LoanID": loan_ids,
+            "LoanAmount": loan_amounts,
+            "ScheduledRepayment": scheduled_repayments,
+        }
+    )
+
+    # One row per loan-month, ordered by month and shuffled within each month like the source file
+    n_rows = n_loans * n_months
+    months = np.repeat(np.arange(1, n_months + 1), n_loans)
+    row_loans = np.concatenate([rng.permutation(n_loans) for _ in range(n_months)])
+
+    # Per row multiplier of the scheduled repayment: 1 paid, 0 missed, 2 prepaid
+    outcome = rng.random(n_rows)
+    multiplier = np.ones(n_rows)
+    multiplier[outcome < missed_rate] = 0.0
+    multiplier[(outcome >= missed_rate) & (outcome < missed_rate + prepayment_rate)] = 2.0
+
+    # Defaulted loans pay nothing from their default month onwards
+    defaulted = rng.random(n_loans) < default_rate
+    default_month = np.where(defaulted, rng.integers(1, n_months + 1, size=n_loans), n_months + 1)
+    multiplier[months >= default_month[row_loans]] = 0.0
+
+    df_actual = pd.DataFrame(
+        {
+            "RepaymentID": np.arange(1, n_rows + 1, dtype=float),
+            "LoanID": loan_ids[row_loans],
+            "Month": months,
+            "ActualRepayment": np.round(scheduled_repayments[row_loans] * multiplier, 2),
+        }
+    )
+
+    return df_scheduled, df_actual
+
+
+def _measure(fn, track_memory):
+    """
+    Run fn() and return (result, seconds, peak traced bytes or None).
+    """
+
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if track_memory else None
+    finally:
+        if track_memory:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def run_benchmark(n_loans, n_months=12, seed=0, track_memory=True, include_reference=False):
+    """
+    Time every stage of the Task_2 pipeline on a synthetic portfolio.
+
+    Args:
+        n_loans (int): Number of loans to generate
+        n_months (int): Number of months of actual repayments per loan
+        seed (int): Seed of the generator
+        track_memory (bool): Record the peak traced memory of each stage, which slows the stages down a little
+        include_reference (bool): Also time the row by row 'calculate_df_balances()', only practical for small sizes
+
+    Returns:
+        list: One dict per stage with `stage`, `n_loans`, `n_rows`, `seconds` and `peak_bytes`.
+
+    """
+
+    (df_scheduled, df_actual), seconds, peak = _measure(
+        lambda: generate_portfolio(n_loans, n_months, seed), track_memory
+    )
+    n_rows = len(df_actual)
+    results = [{"stage": "generate", "seconds": seconds, "peak_bytes": peak}]
+
+    if include_reference:
+        _, seconds, peak = _measure(lambda: py.calculate_df_balances(df_scheduled, df_actual), track_memory)
+        results.append({"stage": "calculate_df_balances", "seconds": seconds, "peak_bytes": peak})
+
+    df_balances, seconds, peak = _measure(
+        lambda: py.calculate_df_balances_vectorized(df_scheduled, df_actual), track_memory
+    )
+    results.append({"stage": "calculate_df_balances_vectorized", "seconds": seconds, "peak_bytes": peak})
+
+    stages = {
+        "question_1": lambda: py.question_1(df_balances),
+        "question_2": lambda: py.question_2(df_scheduled, df_balances),
+        "question_3": lambda: py.question_3(df_balances),
+        "question_4": lambda: py.question_4(df_balances),
+        "portfolio_metrics": lambda: py.PortfolioMetrics(df_balances).as_dict(),
+    }
+    for stage, fn in stages.items():
+        _, seconds, peak = _measure(fn, track_memory)
+        results.append({"stage": stage, "seconds": seconds, "peak_bytes": peak})
+
+    for result in results:
+        result.update({"n_loans": n_loans, "n_rows": n_rows})
+
+    return results
+
+
+def write_results(results, path):
+    """
+    Write benchmark results with environment metadata to a JSON file.
+
+    Args:
+        results (list): Records from 'run_benchmark()'
+        path (str): Output JSON file
+
+    """
+
+    payload = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Task_2 pipeline on synthetic portfolios.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000], help="numbers of loans")
+    parser.add_argument("--months", type=int, default=12, help="months of repayments per loan")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generator")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--no-memory", action="store_true", help="skip peak memory tracking")
+    parser.add_argument("--reference", action="store_true", help="also time the row by row calculate_df_balances")
+    args = parser.parse_args()
+
+    results = []
+    for n_loans in args.sizes:
+        results.extend(
+            run_benchmark(
+                n_loans,
+                n_months=args.months,
+                seed=args.seed,
+                track_memory=not args.no_memory,
+                include_reference=args.reference,
+            )
+        )
+
+    print(pd.DataFrame(results).to_string(index=False))
+    if args.output:
+        write_results(results, args.output)
@@ -0,0 +1,271 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from Python import CACHE_DIR, current_balances_cache_key, load_balances
+
+"""
+Persisted per loan default index, for looking up single loans without rescanning the balances.
+
+'question_1()' and 'question_2()' only return portfolio percentages. 'build_default_index()' computes, once per
+loan, the first month with a type 1 default, the shortfall ratio of every full year, the type 2 flag and the current
+balance, as compact columns sorted by LoanID. 'DefaultIndex' answers:
+
+    index.lookup([17, 86])                      # binary search, O(log n) per LoanID
+    index.filter(type_2=True, min_balance=1e4)  # AND of packed bitmaps and column thresholds
+
+The index is saved as Parquet next to the balances cache, with the 'balances_cache_key()' of the balances it was
+built from in the file metadata, and rebuilt when the key of the repayment files no longer matches.
+
+"""
+
+DEFAULT_INDEX_PATH = os.path.join(CACHE_DIR, "default_index.parquet")
+
+# Parquet metadata entry holding the balances cache key of the index
+BALANCES_KEY_METADATA = b"balances_cache_key"
+
+# Share of a full year's expected payments that can go unpaid before a type 2 default
+TYPE_2_SHORTFALL = 0.15
+
+
+def build_default_index(df_balances):
+    """
+    Aggregate the balances into one row per loan.
+
+    Args:
+        df_balances (DataFrame): Dataframe created from the 'calculate_df_balances()' function
+
+    Returns:
+        DataFrame: Sorted by `LoanID` (in the smallest integer dtype that holds the ids), with
+            `FirstType1DefaultMonth` (0 for loans that never missed a payment), `ShortfallRatioYear<n>` (unpaid share
+            of the expected payments of year n, negative when overpaid and NaN for years without 12 months),
+            `Type1Default`, `Type2Default`, `LastMonth` and `CurrentBalance`, the LoanBalanceEnd of the last month.
+
+    """
+
+    months = df_balances["Month"].to_numpy()
+    actual = df_balances["ActualRepayment"].to_numpy(dtype=float)
+    scheduled = df_balances["ScheduledRepayment"].to_numpy(dtype=float)
+    loan_idx, loan_ids = pd.factorize(df_balances["LoanID"], sort=True)
+    n_loans = len(loan_ids)
+
+    # First month with a repayment short of the schedule
+    missed = actual < scheduled
+    first_missed = np.full(n_loans, np.iinfo(np.int16).max, dtype=np.int16)
+    np.minimum.at(first_missed, loan_idx[missed], months[missed].astype(np.int16))
+    type_1_default = first_missed < np.iinfo(np.int16).max
+    first_missed[~type_1_default] = 0
+
+    # Per loan-year totals, laid out as (loans x years) arrays like 'PortfolioMetrics'
+    year_idx = (months - 1) // 12
+    n_years = year_idx.max() + 1 if len(year_idx) else 0
+    loan_year = loan_idx * n_years + year_idx
+    size = n_loans * n_years
+    months_per_year = np.bincount(loan_year, minlength=size).reshape(n_loans, n_years)
+    expected_per_year = np.bincount(loan_year, weights=scheduled, minlength=size).reshape(n_loans, n_years)
+    actual_per_year = np.bincount(loan_year, weights=actual, minlength=size).reshape(n_loans, n_years)
+
+    full_year = months_per_year == 12
+    type_2_default = (full_year & (actual_per_year < (1 - TYPE_2_SHORTFALL) * expected_per_year)).any(axis=1)
+    shortfall = np.full((n_loans, n_years), np.nan, dtype=np.float32)
+    has_expected = full_year & (expected_per_year > 0)
+    np.divide(expected_per_year - actual_per_year, expected_per_year, out=shortfall, where=has_expected)
+
+    # Balance at the end of every loan's last month
+    order = np.lexsort((months, loan_idx))
+    last_rows = order[np.r_[loan_idx[order][1:] != loan_idx[order][:-1], True]] if len(order) else order
+
+    df_index = pd.DataFrame(
+        {"LoanID": pd.to_numeric(loan_ids.to_numpy(), downcast="integer"), "FirstType1DefaultMonth": first_missed}
+    )
+    for year in range(n_years):
+        df_index[f"ShortfallRatioYear{year + 1}"] = shortfall[:, year]
+    df_index["Type1Default"] = type_1_default
+    df_index["Type2Default"] = type_2_default
+    df_index["LastMonth"] = months[last_rows].astype(np.int16)
+    df_index["CurrentBalance"] = df_balances["LoanBalanceEnd"].to_numpy(dtype=float)[last_rows]
+    return df_index
+
+
+class DefaultIndex:
+    """
+    Per loan default index sorted by LoanID, with binary search lookups and bitmap filters.
+
+    The flag columns are also kept as np.packbits bitmaps, so filters AND one bit per loan and only unpack the result.
+
+    Args:
+        df_index (DataFrame): Output of 'build_default_index()'
+        balances_key (str): 'balances_cache_key()' of the balances the index was built from, if known
+
+    """
+
+    FLAGS = ("Type1Default", "Type2Default")
+
+    def __init__(self, df_index, balances_key=None):
+        self.df_index = df_index.reset_index(drop=True)
+        self.balances_key = balances_key
+        self.loan_ids = self.df_index["LoanID"].to_numpy()
+        self.bitmaps = {flag: np.packbits(self.df_index[flag].to_numpy(dtype=bool)) for flag in self.FLAGS}
+
+    def __len__(self):
+        return len(self.loan_ids)
+
+    @classmethod
+    def from_balances(cls, df_balances, balances_key=None):
+        return cls(build_default_index(df_balances), balances_key)
+
+    @classmethod
+    def read(cls, path=DEFAULT_INDEX_PATH):
+        """
+        Read an index saved by 'write()', memory-mapping the Parquet file.
+        """
+
+        table = pq.read_table(path, memory_map=True)
+        return cls(table.to_pandas(), read_balances_key(path))
+
+    def write(self, path=DEFAULT_INDEX_PATH):
+        """
+        Save the index as Parquet, written to a temporary name and renamed so readers never see a partial file.
+        The balances key is stored in the file metadata.
+
+        Returns:
+            str: Path of the written Parquet file.
+
+        """
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        table = pa.Table.from_pandas(self.df_index, preserve_index=False)
+        if self.balances_key is not None:
+            table = table.replace_schema_metadata(
+                {**table.schema.metadata, BALANCES_KEY_METADATA: self.balances_key.encode()}
+            )
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
+    def positions(self, loan_ids):
+        """
+        Row positions of LoanIDs by binary search.
+
+        Args:
+            loan_ids (array_like): LoanIDs to look up
+
+        Returns:
+            tuple: (positions, found) arrays aligned with loan_ids, positions are only valid where found is True.
+
+        """
+
+        loan_ids = np.asarray(loan_ids)
+        if len(self.loan_ids) == 0:
+            return np.zeros(len(loan_ids), dtype=np.int64), np.zeros(len(loan_ids), dtype=bool)
+        positions = np.searchsorted(self.loan_ids, loan_ids)
+        clipped = np.minimum(positions, len(self.loan_ids) - 1)
+        found = (positions < len(self.loan_ids)) & (self.loan_ids[clipped] == loan_ids)
+        return clipped, found
+
+    def lookup(self, loan_ids):
+        """
+        Index rows of many LoanIDs at once.
+
+        Args:
+            loan_ids (array_like): LoanIDs to look up
+
+        Returns:
+            DataFrame: The index rows of the LoanIDs that exist, in the order they were asked for.
+
+        """
+
+        positions, found = self.positions(np.atleast_1d(loan_ids))
+        return self.df_index.iloc[positions[found]].reset_index(drop=True)
+
+    def get(self, loan_id):
+        """
+        Index row of one LoanID as a dictionary, or None if the loan is not in the index.
+        """
+
+        positions, found = self.positions([loan_id])
+        return self.df_index.iloc[positions[0]].to_dict() if found[0] else None
+
+    def filter(self, type_1=None, type_2=None, min_shortfall=None, min_balance=None):
+        """
+        LoanIDs matching every given condition.
+
+        Args:
+            type_1 (bool): Keep loans with (True) or without (False) a type 1 default
+            type_2 (bool): Keep loans with (True) or without (False) a type 2 default
+            min_shortfall (float): Keep loans with a full year whose shortfall ratio is at least this
+            min_balance (float): Keep loans whose CurrentBalance is at least this
+
+        Returns:
+            ndarray: Sorted LoanIDs.
+
+        """
+
+        bitmap = np.full(len(self.bitmaps["Type1Default"]), 0xFF, dtype=np.uint8)
+        for flag, wanted in zip(self.FLAGS, (type_1, type_2)):
+            if wanted is not None:
+                bitmap &= self.bitmaps[flag] if wanted else ~self.bitmaps[flag]
+
+        selected = np.unpackbits(bitmap, count=len(self.loan_ids)).astype(bool)
+        if min_shortfall is not None:
+            shortfall = self.df_index.filter(like="ShortfallRatioYear").to_numpy()
+            selected &= (shortfall >= min_shortfall).any(axis=1)
+        if min_balance is not None:
+            selected &= self.df_index["CurrentBalance"].to_numpy() >= min_balance
+
+        return self.loan_ids[selected]
+
+
+def read_balances_key(path):
+    """
+    Balances cache key stored in the metadata of a saved index, or None if it has none.
+    """
+
+    metadata = pq.read_schema(path).metadata or {}
+    key = metadata.get(BALANCES_KEY_METADATA)
+    return None if key is None else key.decode()
+
+
+def load_default_index(path=DEFAULT_INDEX_PATH, rebuild=False):
+    """
+    Read the persisted default index, building and saving it first when it is missing or was built from other
+    balances than the current repayment files, by their 'balances_cache_key()'.
+
+    Args:
+        path (str): Parquet file of the index
+        rebuild (bool): Rebuild the index even when it is up to date
+
+    Returns:
+        DefaultIndex: The index of the balances from 'load_balances()'.
+
+    """
+
+    key = current_balances_cache_key()
+    if not rebuild and os.path.exists(path) and read_balances_key(path) == key:
+        return DefaultIndex.read(path)
+
+    index = DefaultIndex.from_balances(load_balances(), key)
+    index.write(path)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up loans in the persisted default index.")
+    parser.add_argument("loan_ids", type=int, nargs="*", help="LoanIDs to look up")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the index from the balances")
+    parser.add_argument("--type-2", action="store_true", help="list every type 2 defaulter")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = load_default_index(rebuild=args.rebuild)
+    print(f"{len(index)} loans indexed, loaded in {time.perf_counter() - start:.3f}s")
+    if args.loan_ids:
+        print(index.lookup(args.loan_ids).to_string(index=False))
+    if args.type_2:
+        print(index.filter(type_2=True))
@@ -0,0 +1,299 @@
+import duckdb
+
+import Python as py
+
+"""
+DuckDB backend for the Task_2 pipeline.
+
+The repayment files are registered as DuckDB views, and the `balances` table and 'question_1' to 'question_4' are
+computed in SQL over them, so DuckDB runs the whole pipeline multi-threaded and can spill to disk. Like Task_1, every
+query is built by a function that returns its SQL string.
+
+'compute_balances()' and 'compute_question()' take a 'backend' argument to pick pandas or DuckDB per call.
+Both backends follow the same definitions. DuckDB computes the balances in closed form instead of month by month
+and accumulates float aggregates in a different order, so its balances and answers can differ from pandas by
+floating-point rounding.
+
+"""
+
+BACKENDS = ("pandas", "duckdb")
+
+
+def _source_sql(path):
+    # Parquet files are scanned directly, anything else is parsed as CSV
+    if path.endswith(".parquet"):
+        return f"read_parquet('{path}')"
+    return f"read_csv_auto('{path}', header=True)"
+
+
+def connect(scheduled_path=py.SCHEDULED_CSV, actual_path=py.ACTUAL_CSV, database=":memory:", config=None):
+    """
+    Open a DuckDB connection with the `scheduled` and `actual` repayment views registered.
+
+    Args:
+        scheduled_path (str): CSV or Parquet file shaped like 'scheduled_loan_repayments.csv'
+        actual_path (str): CSV or Parquet file shaped like 'actual_loan_repayments.csv'
+        database (str): DuckDB database file, in memory by default
+        config (dict): DuckDB settings such as `threads`, `memory_limit` or `temp_directory`
+
+    Returns:
+        DuckDBPyConnection: The connection.
+
+    """
+
+    con = duckdb.connect(database, config=config or {})
+    con.execute(f"CREATE OR REPLACE VIEW scheduled AS SELECT * FROM {_source_sql(scheduled_path)}")
+    con.execute(f"CREATE OR REPLACE VIEW actual AS SELECT * FROM {_source_sql(actual_path)}")
+    return con
+
+
+def balances_query(r_monthly=py.R_MONTHLY):
+    """
+    Balances of every loan and month, the equivalent of 'calculate_df_balances()', with window functions.
+
+    Month by month, a balance B grows by the interest rate r and is reduced by the repayment p, clamped at 0.
+    Unclamped, the balance after the k-th repayment of a loan is (1 + r)^k * (LoanAmount - D_k), where D_k is the
+    running sum of p_j / (1 + r)^j. Repayments are never negative, so D_k only grows, and once the balance reaches
+    0 it stays there, which is also where the unclamped value turns negative. Clamping the closed form at 0 therefore
+    gives the balance with one running sum, without a recursive CTE. The start balance is the same closed form at
+    k - 1, with D_(k-1) = D_k - p_k / (1 + r)^k. The rows are not sorted, read them with ORDER BY LoanID, Month.
+
+    Args:
+        r_monthly (float): Monthly interest rate, defaults to 10% per annum
+
+    """
+
+    growth = f"(1 + {r_monthly!r})"
+    qry = f"""
+        WITH merged AS (
+            SELECT
+                a.RepaymentID,
+                a.LoanID,
+                a.Month,
+                a.ActualRepayment,
+                s.LoanAmount,
+                s.ScheduledRepayment,
+                ROW_NUMBER() OVER (PARTITION BY a.LoanID ORDER BY a.Month) AS Step
+            FROM actual a
+            JOIN scheduled s
+                ON s.LoanID = a.LoanID
+        ),
+        discounted AS (
+            SELECT
+                *,
+                SUM(ActualRepayment * POW({growth}, -Step)) OVER (
+                    PARTITION BY LoanID ORDER BY Month ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                ) AS DiscountedRepayments
+            FROM merged
+        ),
+        closed_form AS (
+            SELECT
+                *,
+                GREATEST(
+                    POW({growth}, Step - 1)
+                        * (LoanAmount - DiscountedRepayments + ActualRepayment * POW({growth}, -Step)),
+                    0
+                ) AS BalanceStart,
+                GREATEST(POW({growth}, Step) * (LoanAmount - DiscountedRepayments), 0) AS BalanceEnd
+            FROM discounted
+        )
+        SELECT
+            RepaymentID,
+            LoanID,
+            Month,
+            ActualRepayment,
+            LoanAmount,
+            ScheduledRepayment,
+            ROUND(BalanceStart, 2) AS LoanBalanceStart,
+            ROUND(BalanceEnd, 2) AS LoanBalanceEnd,
+            ROUND(BalanceStart * {r_monthly!r}, 2) AS InterestPayment
+        FROM closed_form;
+    """
+
+    return qry
+
+
+def build_balances(con, r_monthly=py.R_MONTHLY):
+    """
+    Create the `balances` table from 'balances_query()'.
+
+    Args:
+        con (DuckDBPyConnection): Connection from 'connect()'
+        r_monthly (float): Monthly interest rate, defaults to 10% per annum
+
+    """
+
+    con.execute(f"CREATE OR REPLACE TABLE balances AS {balances_query(r_monthly)}")
+
+
+def question_1_query():
+    """
+    Percent of loans with a type 1 default, see 'Python.question_1()'.
+    """
+
+    qry = """
+        SELECT
+            (CAST(COUNT(DISTINCT CASE WHEN ActualRepayment < ScheduledRepayment THEN LoanID END) AS DOUBLE)
+                / COUNT(DISTINCT LoanID)) * 100 AS Answer
+        FROM balances;
+    """
+
+    return qry
+
+
+def question_2_query():
+    """
+    Percent of loans with a type 2 default in any full 12-month year, see 'Python.question_2()'.
+    """
+
+    qry = """
+        WITH yearly AS (
+            SELECT
+                LoanID,
+                (Month - 1) // 12 + 1 AS Year,
+                COUNT(Month) AS Months,
+                SUM(ScheduledRepayment) AS Expected,
+                SUM(ActualRepayment) AS Actual
+            FROM balances
+            GROUP BY LoanID, Year
+            HAVING COUNT(Month) = 12
+        ),
+        per_loan AS (
+            SELECT
+                LoanID,
+                BOOL_OR(Actual < 0.85 * Expected) AS type_2_default
+            FROM yearly
+            GROUP BY LoanID
+        )
+        SELECT 100.0 * SUM(CAST(type_2_default AS INTEGER)) / COUNT(*) AS Answer
+        FROM per_loan;
+    """
+
+    return qry
+
+
+def question_3_query():
+    """
+    Annualised portfolio CPR from the geometric mean SMM of months 1 to 12, see 'Python.question_3()'.
+    """
+
+    qry = """
+        WITH monthly AS (
+            SELECT
+                Month,
+                SUM(LoanBalanceStart) AS LoanBalanceStart,
+                SUM(ActualRepayment) AS ActualRepayment,
+                SUM(ScheduledRepayment) AS ScheduledRepayment
+            FROM balances
+            WHERE Month BETWEEN 1 AND 12
+            GROUP BY Month
+            HAVING SUM(LoanBalanceStart) > 0
+        ),
+        smm AS (
+            SELECT GREATEST(ActualRepayment - ScheduledRepayment, 0) / LoanBalanceStart AS SMM
+            FROM monthly
+        )
+        SELECT (1 - POW(1 - (POW(PRODUCT(1 + SMM), 1 / 12) - 1), 12)) * 100 AS Answer
+        FROM smm;
+    """
+
+    return qry
+
+
+def question_4_query(recovery_rate=0.8):
+    """
+    Predicted second-year loss from the type 2 default rate and the month 12 exposure, see 'Python.question_4()'.
+    """
+
+    qry = f"""
+        WITH probability AS (
+            {question_2_query().rstrip().rstrip(";")}
+        ),
+        exposure AS (
+            SELECT SUM(LoanBalanceEnd) AS Exposure
+            FROM balances
+            WHERE Month = 12
+        )
+        SELECT (p.Answer / 100.0) * e.Exposure * (1.0 - {recovery_rate!r}) AS Answer
+        FROM probability p
+        CROSS JOIN exposure e;
+    """
+
+    return qry
+
+
+_QUESTION_QUERIES = {
+    1: question_1_query,
+    2: question_2_query,
+    3: question_3_query,
+    4: question_4_query,
+}
+
+
+def _check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, got {backend!r}")
+
+
+def compute_balances(backend="pandas", con=None):
+    """
+    Compute the balances Dataframe with the chosen backend.
+
+    Args:
+        backend (str): "pandas" for 'Python.load_balances()', "duckdb" for 'build_balances()'
+        con (DuckDBPyConnection): Connection from 'connect()', opened and closed on the default data files if omitted
+
+    Returns:
+        DataFrame: The balances, sorted by LoanID and Month.
+
+    """
+
+    _check_backend(backend)
+    if backend == "pandas":
+        return py.load_balances()
+
+    if con is None:
+        with connect() as con:
+            return compute_balances(backend, con)
+
+    build_balances(con)
+    return con.execute("SELECT * FROM balances ORDER BY LoanID, Month").df()
+
+
+def compute_question(number, backend="pandas", con=None):
+    """
+    Answer one of 'question_1' to 'question_4' with the chosen backend.
+
+    The DuckDB backend builds the `balances` table on the connection the first time it is needed.
+
+    Args:
+        number (int): Question number, 1 to 4
+        backend (str): "pandas" or "duckdb"
+        con (DuckDBPyConnection): Connection from 'connect()', opened and closed on the default data files if omitted
+
+    Returns:
+        float: The answer to the question.
+
+    """
+
+    _check_backend(backend)
+    if number not in _QUESTION_QUERIES:
+        raise ValueError(f"question number must be one of {sorted(_QUESTION_QUERIES)}, got {number!r}")
+
+    if backend == "pandas":
+        df_balances = py.load_balances()
+        if number == 2:
+            return py.question_2(py.load_scheduled(), df_balances)
+        return getattr(py, f"question_{number}")(df_balances)
+
+    if con is None:
+        with connect() as con:
+            return compute_question(number, backend, con)
+
+    has_balances = con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = 'balances'"
+    ).fetchone()[0]
+    if not has_balances:
+        build_balances(con)
+
+    return con.execute(_QUESTION_QUERIES[number]()).fetchone()[0]
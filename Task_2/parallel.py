@@ -0,0 +1,190 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+from Python import R_MONTHLY, add_balance_columns, amortize_arrays, load_actual, load_scheduled
+
+"""
+Multi-core balance computation, with loans sharded across a process pool.
+
+Each loan's amortization only depends on its own rows, so contiguous ranges of loans are handed to
+separate worker processes. The input and output columns live in one shared memory block: workers
+receive only the block name and their row range, and write their results into disjoint slices of it,
+so no DataFrames are pickled and the merged result is deterministic.
+
+"""
+
+# Column layout of the shared memory block, every column is 8 bytes per row
+_INPUT_COLUMNS = ["LoanID", "ActualRepayment", "OpeningBalance"]
+_OUTPUT_COLUMNS = ["LoanBalanceStart", "LoanBalanceEnd", "InterestPayment"]
+_COLUMNS = _INPUT_COLUMNS + _OUTPUT_COLUMNS
+
+
+def _shared_columns(buffer, n_rows):
+    """
+    Map the shared memory block to one NumPy array per column.
+    """
+
+    columns = {}
+    for position, name in enumerate(_COLUMNS):
+        dtype = np.int64 if name == "LoanID" else np.float64
+        columns[name] = np.ndarray(n_rows, dtype=dtype, buffer=buffer, offset=position * n_rows * 8)
+    return columns
+
+
+def _amortize_shard(shm_name, n_rows, start, stop, r_monthly):
+    """
+    Worker entry point: amortize rows [start, stop) of the shared block in place.
+    """
+
+    shm = SharedMemory(name=shm_name)
+    try:
+        columns = _shared_columns(shm.buf, n_rows)
+        balances = amortize_arrays(
+            columns["LoanID"][start:stop],
+            columns["ActualRepayment"][start:stop],
+            columns["OpeningBalance"][start:stop],
+            r_monthly,
+        )
+        for name, values in zip(_OUTPUT_COLUMNS, balances):
+            columns[name][start:stop] = values
+        del columns
+    finally:
+        shm.close()
+
+
+def _shard_bounds(loan_ids, n_shards):
+    """
+    Split sorted rows into at most n_shards contiguous ranges that never cut a loan in two.
+    """
+
+    loan_starts = np.flatnonzero(np.r_[True, loan_ids[1:] != loan_ids[:-1]])
+    targets = np.linspace(0, len(loan_ids), n_shards + 1)[1:-1]
+    cuts = loan_starts[np.minimum(np.searchsorted(loan_starts, targets), len(loan_starts) - 1)]
+    bounds = np.unique(np.r_[0, cuts, len(loan_ids)])
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def calculate_df_balances_parallel(df_scheduled, df_actual, n_workers=None, r_monthly=R_MONTHLY):
+    """
+    Multi-process equivalent of 'calculate_df_balances_vectorized()', with identical output.
+
+    Args:
+        df_scheduled (DataFrame): Dataframe created from the 'scheduled_loan_repayments.csv' dataset
+        df_actual (DataFrame): Dataframe created from the 'actual_loan_repayments.csv' dataset
+        n_workers (int): Number of worker processes, defaults to the number of CPUs.
+            With 1 worker the computation runs in the calling process.
+        r_monthly (float): Monthly interest rate, defaults to 10% per annum
+
+    Returns:
+        DataFrame: A merged Dataframe with additional calculated columns to help with the following questions.
+
+    """
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    # Merge and order rows exactly like 'calculate_df_balances_vectorized()'
+    df_balances = pd.merge(df_actual, df_scheduled)
+    df_balances = df_balances.sort_values(["LoanID", "Month"], kind="mergesort").reset_index(drop=True)
+
+    loan_ids = df_balances["LoanID"].to_numpy(dtype=np.int64)
+    repayments = df_balances["ActualRepayment"].to_numpy(dtype=float)
+    opening_balances = df_balances["LoanAmount"].to_numpy(dtype=float)
+    n_rows = len(df_balances)
+
+    if n_workers == 1 or n_rows == 0:
+        add_balance_columns(df_balances, *amortize_arrays(loan_ids, repayments, opening_balances, r_monthly))
+        return df_balances
+
+    shm = SharedMemory(create=True, size=len(_COLUMNS) * n_rows * 8)
+    try:
+        columns = _shared_columns(shm.buf, n_rows)
+        columns["LoanID"][:] = loan_ids
+        columns["ActualRepayment"][:] = repayments
+        columns["OpeningBalance"][:] = opening_balances
+
+        shards = _shard_bounds(loan_ids, n_workers)
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(shards))) as pool:
+            futures = [
+                pool.submit(_amortize_shard, shm.name, n_rows, start, stop, r_monthly)
+                for start, stop in shards
+            ]
+            for future in futures:
+                future.result()
+
+        add_balance_columns(df_balances, *(columns[name].copy() for name in _OUTPUT_COLUMNS))
+        del columns
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return df_balances
+
+
+def replicate_portfolio(df_scheduled, df_actual, copies):
+    """
+    Scale the portfolio up by repeating every loan with new LoanIDs, for benchmarking.
+
+    Args:
+        df_scheduled (DataFrame): Dataframe created from the 'scheduled_loan_repayments.csv' dataset
+        df_actual (DataFrame): Dataframe created from the 'actual_loan_repayments.csv' dataset
+        copies (int): Number of copies of the portfolio
+
+    Returns:
+        tuple: The replicated (df_scheduled, df_actual).
+
+    """
+
+    offset = int(df_scheduled["LoanID"].max())
+    scheduled, actual = [], []
+    for copy in range(copies):
+        scheduled.append(df_scheduled.assign(LoanID=df_scheduled["LoanID"] + copy * offset))
+        actual.append(df_actual.assign(LoanID=df_actual["LoanID"] + copy * offset))
+    return pd.concat(scheduled, ignore_index=True), pd.concat(actual, ignore_index=True)
+
+
+def benchmark_parallel(df_scheduled, df_actual, worker_counts=(1, 2, 4, 8), repeat=3):
+    """
+    Time 'calculate_df_balances_parallel()' for several worker counts.
+
+    Args:
+        df_scheduled (DataFrame): Scheduled repayments
+        df_actual (DataFrame): Actual repayments
+        worker_counts (tuple): Worker counts to time
+        repeat (int): Number of runs per worker count, the fastest one is kept
+
+    Returns:
+        DataFrame: Columns `Workers`, `Seconds` and `Speedup` relative to the first worker count.
+
+    """
+
+    results = []
+    for n_workers in worker_counts:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            calculate_df_balances_parallel(df_scheduled, df_actual, n_workers=n_workers)
+            timings.append(time.perf_counter() - start)
+        results.append({"Workers": n_workers, "Seconds": min(timings)})
+
+    df_results = pd.DataFrame(results)
+    df_results["Speedup"] = df_results["Seconds"].iloc[0] / df_results["Seconds"]
+    return df_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the parallel balance computation.")
+    parser.add_argument("--copies", type=int, default=100, help="copies of the sample portfolio to amortize")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="worker counts to time")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per worker count")
+    args = parser.parse_args()
+
+    df_scheduled, df_actual = replicate_portfolio(load_scheduled(), load_actual(), args.copies)
+    print(f"{len(df_scheduled)} loans, {len(df_actual)} loan-months")
+    print(benchmark_parallel(df_scheduled, df_actual, args.workers, args.repeat).to_string(index=False))
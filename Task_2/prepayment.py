@@ -0,0 +1,200 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from Python import load_balances, loan_month_positions
+
+"""
+Prepayment analytics over many groupings of the balances at once.
+
+'question_3()' aggregates the portfolio by Month and returns a single CPR for months 1 to 12. 'PrepaymentAnalytics'
+computes the SMM series of every group of several groupings (the whole portfolio, origination cohort, loan size bucket,
+or any per row key) with one bincount per column over all groupings together. For every group it keeps the cumulative
+product of (1 + SMM) over the months, so the geometric mean SMM, and from it the CPR, of any window of months is the
+ratio of two prefix entries:
+
+    prod(1 + SMM[first..last]) = prefix[last] / prefix[first - 1]
+
+which answers a rolling 3, 6 or 12 month CPR for every group and month without another pass over the balances.
+
+"""
+
+# Lower edges of the loan size buckets, by LoanAmount
+LOAN_SIZE_EDGES = (0, 25_000, 50_000, 75_000, 100_000)
+
+
+def default_groupings(df_balances, loan_size_edges=LOAN_SIZE_EDGES):
+    """
+    Per row keys of the standard groupings.
+
+    Args:
+        df_balances (DataFrame): Dataframe created from the 'calculate_df_balances()' function,
+            sorted by LoanID and Month
+        loan_size_edges (tuple): Ascending lower edges of the loan size buckets
+
+    Returns:
+        dict: `Portfolio` (one group), `Cohort` (the Month of each loan's first repayment) and `LoanSize`
+            (the lower edge of each loan's LoanAmount bucket), each an array aligned with the rows.
+
+    """
+
+    months = df_balances["Month"].to_numpy()
+    loan_amounts = df_balances["LoanAmount"].to_numpy(dtype=float)
+    edges = np.asarray(loan_size_edges)
+
+    cohorts = months.copy()
+    if len(months):
+        is_first_month, loan_idx, _ = loan_month_positions(df_balances["LoanID"].to_numpy())
+        cohorts = months[is_first_month][loan_idx]
+
+    return {
+        "Portfolio": np.zeros(len(months), dtype=np.int64),
+        "Cohort": cohorts,
+        "LoanSize": edges[np.searchsorted(edges, loan_amounts, side="right") - 1],
+    }
+
+
+def geometric_mean_cpr(product, n_months):
+    """
+    Annualised CPR percent from the product of (1 + SMM) over n_months, as in 'question_3()'.
+    """
+
+    smm_mean = product ** (1 / n_months) - 1
+    return (1 - (1 - smm_mean) ** 12) * 100
+
+
+class PrepaymentAnalytics:
+    """
+    SMM series and windowed CPR for many groupings, computed in one grouped pass over the balances.
+
+    SMM follows 'question_3()': per group and month, the unscheduled principal max(0, actual - scheduled repayments)
+    divided by the start of month balance. Months where a group has no start balance count as an SMM of 0, so a
+    window always spans its full number of months. The 'Portfolio' CPR of months 1 to 12 is 'question_3()'.
+
+    Args:
+        df_balances (DataFrame): Dataframe created from the 'calculate_df_balances()' function,
+            sorted by LoanID and Month
+        groupings (dict): Per row group keys by grouping name, as arrays or column names of df_balances.
+            Defaults to 'default_groupings()'.
+
+    """
+
+    def __init__(self, df_balances, groupings=None):
+        if groupings is None:
+            groupings = default_groupings(df_balances)
+
+        months = df_balances["Month"].to_numpy()
+        self.n_months = int(months.max()) if len(months) else 0
+        n_columns = self.n_months + 1
+
+        # Group index of every row per grouping, with the groupings laid end to end
+        self.groups = {}
+        self._offsets = {}
+        cells = []
+        offset = 0
+        for name, keys in groupings.items():
+            keys = df_balances[keys] if isinstance(keys, str) else keys
+            codes, uniques = pd.factorize(np.asarray(keys), sort=True)
+            self.groups[name] = pd.Index(uniques, name=name)
+            self._offsets[name] = offset
+            cells.append((offset + codes) * n_columns + months)
+            offset += len(uniques)
+        cells = np.concatenate(cells) if cells else np.zeros(0, dtype=np.int64)
+
+        # One bincount per column over every grouping, laid out as (groups x months)
+        n_groupings = len(groupings)
+        size = offset * n_columns
+
+        def totals(column):
+            weights = np.tile(df_balances[column].to_numpy(dtype=float), n_groupings)
+            return np.bincount(cells, weights=weights, minlength=size).reshape(offset, n_columns)[:, 1:]
+
+        start = totals("LoanBalanceStart")
+        unscheduled_principal = np.clip(totals("ActualRepayment") - totals("ScheduledRepayment"), 0, None)
+        self._smm = np.divide(unscheduled_principal, start, out=np.zeros_like(start), where=start > 0)
+
+        # prefix[:, m] is the product of (1 + SMM) over months 1 to m, with prefix[:, 0] = 1
+        self._prefix = np.ones((offset, n_columns))
+        np.cumprod(1 + self._smm, axis=1, out=self._prefix[:, 1:])
+
+    def _rows(self, grouping):
+        offset = self._offsets[grouping]
+        return slice(offset, offset + len(self.groups[grouping]))
+
+    def smm(self, grouping="Portfolio"):
+        """
+        SMM of every group and month.
+
+        Args:
+            grouping (str): Name of the grouping
+
+        Returns:
+            DataFrame: SMM with one row per group and one column per Month.
+
+        """
+
+        return pd.DataFrame(
+            self._smm[self._rows(grouping)],
+            index=self.groups[grouping],
+            columns=pd.RangeIndex(1, self.n_months + 1, name="Month"),
+        )
+
+    def window_cpr(self, grouping="Portfolio", first_month=1, last_month=12):
+        """
+        CPR percent of every group from the geometric mean SMM of months first_month to last_month, in O(1) per group.
+
+        Args:
+            grouping (str): Name of the grouping
+            first_month (int): First month of the window
+            last_month (int): Last month of the window, included
+
+        Returns:
+            Series: CPR percent indexed by group.
+
+        """
+
+        if not 1 <= first_month <= last_month <= self.n_months:
+            raise ValueError(f"window {first_month}-{last_month} is outside months 1-{self.n_months}")
+
+        prefix = self._prefix[self._rows(grouping)]
+        product = prefix[:, last_month] / prefix[:, first_month - 1]
+        return pd.Series(
+            geometric_mean_cpr(product, last_month - first_month + 1), index=self.groups[grouping], name="CPR"
+        )
+
+    def rolling_cpr(self, grouping="Portfolio", window=12):
+        """
+        Rolling CPR percent of every group over windows of consecutive months.
+
+        Args:
+            grouping (str): Name of the grouping
+            window (int): Number of months in every window
+
+        Returns:
+            DataFrame: CPR percent with one row per group and one column per Month ending a full window.
+
+        """
+
+        if not 1 <= window <= self.n_months:
+            raise ValueError(f"window of {window} months is outside months 1-{self.n_months}")
+
+        prefix = self._prefix[self._rows(grouping)]
+        return pd.DataFrame(
+            geometric_mean_cpr(prefix[:, window:] / prefix[:, :-window], window),
+            index=self.groups[grouping],
+            columns=pd.RangeIndex(window, self.n_months + 1, name="Month"),
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SMM and CPR by cohort and loan size bucket.")
+    parser.add_argument("--windows", type=int, nargs="+", default=[3, 6, 12], help="rolling windows in months")
+    args = parser.parse_args()
+
+    analytics = PrepaymentAnalytics(load_balances())
+    for grouping in analytics.groups:
+        for window in args.windows:
+            if window <= analytics.n_months:
+                print(f"\n{grouping}, rolling {window} month CPR %:")
+                print(analytics.rolling_cpr(grouping, window).round(4).to_string())
@@ -0,0 +1,156 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from Python import R_MONTHLY, PortfolioMetrics, load_balances, loan_month_positions
+
+"""
+Scenario engine for the expected loss of 'question_4()'.
+
+'question_4()' is a single point estimate: probability_of_default * exposure * (1 - recovery_rate). Stress testing
+evaluates it for whole grids of probability of default (PD), recovery rate and interest rate assumptions. The exposure
+entering year 2 is computed once per loan, and once per interest rate when rates are shocked, by amortizing every loan
+under every rate in the same batched month loop. Expected loss over the whole grid is then a single matrix product
+with that exposure matrix, so adding PD and recovery scenarios costs no extra passes over the balances.
+
+"""
+
+# Month whose closing balance is the exposure entering year 2
+EXPOSURE_MONTH = 12
+
+
+def loan_exposures(df_balances, annual_rates=None, month=EXPOSURE_MONTH):
+    """
+    Per loan exposure at the end of a month, optionally re-amortized under shocked interest rates.
+
+    Args:
+        df_balances (DataFrame): Dataframe created from the 'calculate_df_balances()' function,
+            sorted by LoanID and Month
+        annual_rates (array_like): Annual interest rates to re-amortize every loan under, e.g. [0.08, 0.1, 0.12].
+            If omitted, the LoanBalanceEnd already in df_balances is used.
+        month (int): Month whose closing balance is the exposure
+
+    Returns:
+        tuple: (loan_ids, exposures), with exposures a (rates x loans) array rounded to cents like the balances.
+            Loans without a row for the month have no exposure.
+
+    """
+
+    loan_ids = df_balances["LoanID"].to_numpy()
+    months = df_balances["Month"].to_numpy()
+    if len(loan_ids) == 0:
+        n_rates = 1 if annual_rates is None else len(np.atleast_1d(annual_rates))
+        return loan_ids, np.zeros((n_rates, 0))
+
+    is_first_month, loan_idx, month_idx = loan_month_positions(loan_ids)
+    n_loans = loan_idx[-1] + 1
+    at_month = months == month
+
+    if annual_rates is None:
+        exposures = np.zeros((1, n_loans))
+        exposures[0, loan_idx[at_month]] = df_balances["LoanBalanceEnd"].to_numpy(dtype=float)[at_month]
+        return loan_ids[is_first_month], exposures
+
+    # Amortize every loan under every rate at once, with balances laid out as (rates x loans)
+    r_monthly = np.asarray(annual_rates, dtype=float).reshape(-1, 1) / 12
+    n_steps = month_idx[at_month].max() + 1 if at_month.any() else 0
+    repayment_grid = np.zeros((n_loans, n_steps))
+    in_grid = month_idx < n_steps
+    repayments = df_balances["ActualRepayment"].to_numpy(dtype=float)
+    repayment_grid[loan_idx[in_grid], month_idx[in_grid]] = repayments[in_grid]
+
+    # Grid step at which each loan reaches the month, -1 for loans without it
+    exposure_step = np.full(n_loans, -1)
+    exposure_step[loan_idx[at_month]] = month_idx[at_month]
+
+    balances = np.tile(df_balances["LoanAmount"].to_numpy(dtype=float)[is_first_month], (len(r_monthly), 1))
+    exposures = np.zeros((len(r_monthly), n_loans))
+    for step in range(n_steps):
+        new_balance = (balances + balances * r_monthly) - repayment_grid[:, step]
+        balances = np.where(new_balance > 0, new_balance, 0.0)
+        reached = exposure_step == step
+        exposures[:, reached] = balances[:, reached]
+
+    return loan_ids[is_first_month], np.round(exposures, 2)
+
+
+def expected_loss_grid(probability_of_default, recovery_rate, exposures):
+    """
+    Expected loss for every combination of PD, recovery rate and exposure scenario.
+
+    Args:
+        probability_of_default (array_like): PD scenarios as fractions, either one portfolio PD per scenario (pd,)
+            or one PD per loan per scenario (pd x loans)
+        recovery_rate (array_like): Recovery rate scenarios as fractions (recovery,)
+        exposures (ndarray): Exposure per loan per rate scenario (rates x loans), from 'loan_exposures()'
+
+    Returns:
+        ndarray: Expected loss as a (pd x recovery x rates) array.
+
+    """
+
+    probability_of_default = np.asarray(probability_of_default, dtype=float)
+    loss_given_default = 1.0 - np.asarray(recovery_rate, dtype=float).reshape(-1)
+    exposures = np.asarray(exposures, dtype=float)
+
+    if probability_of_default.ndim == 2:
+        # Per loan PDs weight each loan's exposure: (pd x loans) @ (loans x rates)
+        expected_default = probability_of_default @ exposures.T
+    else:
+        expected_default = probability_of_default.reshape(-1, 1) * exposures.sum(axis=1)
+
+    return expected_default[:, None, :] * loss_given_default[None, :, None]
+
+
+def scenario_grid(df_balances, probability_of_default=None, recovery_rate=(0.8,), annual_rates=None):
+    """
+    Expected loss over a grid of portfolio PD, recovery rate and interest rate scenarios.
+
+    Args:
+        df_balances (DataFrame): Dataframe created from the 'calculate_df_balances()' function
+        probability_of_default (array_like): Portfolio PDs as fractions, defaults to the type 2 default rate of year 1
+        recovery_rate (array_like): Recovery rates as fractions
+        annual_rates (array_like): Annual interest rates, defaults to the 10% of the balances without re-amortizing
+
+    Returns:
+        DataFrame: One row per scenario with `ProbabilityOfDefault`, `RecoveryRate`, `AnnualRate`, `Exposure` and
+            `ExpectedLoss`. The default scenario reproduces 'question_4()'.
+
+    """
+
+    if probability_of_default is None:
+        probability_of_default = [PortfolioMetrics(df_balances).type_2_default_rate / 100.0]
+    probability_of_default = np.atleast_1d(np.asarray(probability_of_default, dtype=float))
+    recovery_rate = np.atleast_1d(np.asarray(recovery_rate, dtype=float))
+
+    _, exposures = loan_exposures(df_balances, annual_rates)
+    rates = np.array([R_MONTHLY * 12]) if annual_rates is None else np.atleast_1d(np.asarray(annual_rates, dtype=float))
+    losses = expected_loss_grid(probability_of_default, recovery_rate, exposures)
+
+    pd_grid, recovery_grid, rate_idx = np.meshgrid(
+        probability_of_default, recovery_rate, np.arange(len(rates)), indexing="ij"
+    )
+    return pd.DataFrame(
+        {
+            "ProbabilityOfDefault": pd_grid.ravel(),
+            "RecoveryRate": recovery_grid.ravel(),
+            "AnnualRate": rates[rate_idx.ravel()],
+            "Exposure": exposures.sum(axis=1)[rate_idx.ravel()],
+            "ExpectedLoss": losses.ravel(),
+        }
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expected loss over a grid of stress scenarios.")
+    parser.add_argument("--pd-multipliers", type=float, nargs="+", default=[0.5, 1.0, 1.5, 2.0, 3.0],
+                        help="multiples of the year 1 type 2 default rate")
+    parser.add_argument("--recovery", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9], help="recovery rates")
+    parser.add_argument("--rates", type=float, nargs="+", default=[0.08, 0.1, 0.12, 0.14], help="annual interest rates")
+    args = parser.parse_args()
+
+    df_balances = load_balances()
+    base_pd = PortfolioMetrics(df_balances).type_2_default_rate / 100.0
+    df_scenarios = scenario_grid(df_balances, base_pd * np.array(args.pd_multipliers), args.recovery, args.rates)
+    print(df_scenarios.sort_values("ExpectedLoss", ascending=False).to_string(index=False))
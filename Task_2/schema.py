@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+
+from Python import ACTUAL_CSV, SCHEDULED_CSV, calculate_df_balances_vectorized
+
+"""
+Compact dtype schema for the Task_2 repayment datasets.
+
+pd.read_csv defaults every column to 64 bits. The schemas below keep LoanID and Month in the smallest
+integer type that holds them. Amounts stay float64 by default, because float32 only has ~7 significant
+digits and balances above 100000.00 would lose cents. Instead, amounts can be stored as fixed-point
+int32 cents, which is exact for the 2 decimal amounts in the files.
+
+"""
+
+# Compact dtypes per column. Amounts are listed as float64 and converted to cents on request.
+SCHEDULED_SCHEMA = {
+    "LoanID": "int32",
+    "LoanAmount": "float64",
+    "ScheduledRepayment": "float64",
+}
+
+# RepaymentID stays float64: the file stores '1.0' and one row has the non-integer ID 4614.49
+ACTUAL_SCHEMA = {
+    "RepaymentID": "float64",
+    "LoanID": "int32",
+    "Month": "int16",
+    "ActualRepayment": "float64",
+}
+
+BALANCES_SCHEMA = {
+    **ACTUAL_SCHEMA,
+    **SCHEDULED_SCHEMA,
+    "LoanBalanceStart": "float64",
+    "LoanBalanceEnd": "float64",
+    "InterestPayment": "float64",
+}
+
+AMOUNT_COLUMNS = [
+    "LoanAmount",
+    "ScheduledRepayment",
+    "ActualRepayment",
+    "LoanBalanceStart",
+    "LoanBalanceEnd",
+    "InterestPayment",
+]
+
+
+def _cast_integer(values, dtype):
+    """
+    Cast a column to a narrower integer type, failing instead of silently truncating or overflowing.
+    """
+
+    info = np.iinfo(dtype)
+    array = values.to_numpy()
+    if not np.all(np.mod(array, 1) == 0):
+        raise ValueError(f"column {values.name!r} has non-integer values and cannot be stored as {dtype}")
+    if len(array) and (array.min() < info.min or array.max() > info.max):
+        raise ValueError(f"column {values.name!r} does not fit in {dtype}")
+    return values.astype(dtype)
+
+
+def to_cents(values):
+    """
+    Convert an amount column to fixed-point int32 cents.
+
+    Args:
+        values (Series): Amounts with at most 2 decimals
+
+    Returns:
+        Series: The amounts in cents.
+
+    Raises:
+        ValueError: If an amount has more than 2 decimals or does not fit in int32 cents.
+
+    """
+
+    cents = np.round(values.to_numpy(dtype=float) * 100)
+    if not np.allclose(cents, values.to_numpy(dtype=float) * 100, rtol=0, atol=1e-6):
+        raise ValueError(f"column {values.name!r} has amounts with more than 2 decimals")
+    return _cast_integer(pd.Series(cents, index=values.index, name=values.name), "int32")
+
+
+def from_cents(values):
+    """
+    Convert an int32 cents column back to float64 amounts.
+    """
+
+    return values.astype("float64") / 100
+
+
+def apply_schema(df, schema, amounts="float64"):
+    """
+    Cast a Dataframe to a compact schema.
+
+    Args:
+        df (DataFrame): Frame with (a subset of) the schema's columns
+        schema (dict): One of 'SCHEDULED_SCHEMA', 'ACTUAL_SCHEMA' or 'BALANCES_SCHEMA'
+        amounts (str): "float64" to keep amounts as floats, "cents" to store them as int32 cents
+
+    Returns:
+        DataFrame: A compact copy of the frame.
+
+    """
+
+    if amounts not in ("float64", "cents"):
+        raise ValueError(f"amounts must be 'float64' or 'cents', got {amounts!r}")
+
+    df_compact = df.copy()
+    for column, dtype in schema.items():
+        if column not in df_compact:
+            continue
+        if column in AMOUNT_COLUMNS and amounts == "cents":
+            df_compact[column] = to_cents(df_compact[column])
+        elif np.issubdtype(np.dtype(dtype), np.integer):
+            df_compact[column] = _cast_integer(df_compact[column], dtype)
+        else:
+            df_compact[column] = df_compact[column].astype(dtype)
+
+    return df_compact
+
+
+def read_scheduled(path=SCHEDULED_CSV, amounts="float64"):
+    """
+    Read a 'scheduled_loan_repayments.csv' shaped file with the compact schema, sorted by LoanID.
+    """
+
+    df_scheduled = pd.read_csv(path, dtype={"LoanID": "int32"})
+    df_scheduled = df_scheduled.sort_values("LoanID", kind="mergesort").reset_index(drop=True)
+    return apply_schema(df_scheduled, SCHEDULED_SCHEMA, amounts)
+
+
+def read_actual(path=ACTUAL_CSV, amounts="float64"):
+    """
+    Read an 'actual_loan_repayments.csv' shaped file with the compact schema.
+    """
+
+    df_actual = pd.read_csv(path, dtype={"RepaymentID": "float64", "LoanID": "int32", "Month": "int16"})
+    return apply_schema(df_actual, ACTUAL_SCHEMA, amounts)
+
+
+def memory_report(frames):
+    """
+    Report the in-memory size of Dataframes.
+
+    Args:
+        frames (dict): Label to DataFrame, e.g. {"balances (default)": df_a, "balances (compact)": df_b}
+
+    Returns:
+        DataFrame: Columns `Frame`, `Rows`, `Bytes` and `BytesPerRow`. For balances frames a row is one loan-month.
+
+    """
+
+    rows = []
+    for label, df in frames.items():
+        n_bytes = int(df.memory_usage(index=True, deep=True).sum())
+        rows.append(
+            {
+                "Frame": label,
+                "Rows": len(df),
+                "Bytes": n_bytes,
+                "BytesPerRow": n_bytes / len(df) if len(df) else 0.0,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    df_scheduled = pd.read_csv(SCHEDULED_CSV)
+    df_actual = pd.read_csv(ACTUAL_CSV)
+    df_balances = calculate_df_balances_vectorized(df_scheduled, df_actual)
+
+    df_balances_compact = apply_schema(
+        calculate_df_balances_vectorized(read_scheduled(), read_actual()), BALANCES_SCHEMA
+    )
+
+    print(
+        memory_report(
+            {
+                "scheduled (default)": df_scheduled,
+                "scheduled (compact)": read_scheduled(),
+                "actual (default)": df_actual,
+                "actual (compact)": read_actual(),
+                "actual (cents)": read_actual(amounts="cents"),
+                "balances (default)": df_balances,
+                "balances (compact)": df_balances_compact,
+                "balances (cents)": apply_schema(df_balances_compact, BALANCES_SCHEMA, amounts="cents"),
+            }
+        ).to_string(index=False)
+    )
@@ -0,0 +1,166 @@
+import math
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from Python import R_MONTHLY, calculate_df_balances_vectorized
+
+"""
+Streaming balance computation for actual repayment files that do not fit in memory.
+
+The actual repayments are read in chunks and regrouped so that every loan's rows are processed
+together. Each group is joined against an in-memory index of the scheduled repayments and amortized
+with 'calculate_df_balances_vectorized()', so peak memory is bounded by the group size and not
+by the size of the file.
+
+"""
+
+# dtypes pd.read_csv infers for the full 'actual_loan_repayments.csv', fixed so every chunk agrees
+ACTUAL_DTYPES = {
+    "RepaymentID": "float64",
+    "LoanID": "int64",
+    "Month": "int64",
+    "ActualRepayment": "float64",
+}
+
+# Rough on-disk size of one actual repayment row, used to size the spill partitions
+_BYTES_PER_ROW = 24
+
+
+def _amortize_chunk(df_scheduled_index, df_chunk, r_monthly):
+    """
+    Join a chunk of actual repayments against the scheduled index and amortize it.
+    """
+
+    loan_ids = pd.unique(df_chunk["LoanID"])
+    df_scheduled = df_scheduled_index.reindex(loan_ids).dropna(how="all").reset_index()
+    return calculate_df_balances_vectorized(df_scheduled, df_chunk, r_monthly)
+
+
+def _iter_sorted_groups(actual_path, chunksize):
+    """
+    Yield frames of complete loans from a file whose rows are already grouped by LoanID.
+
+    The rows of the last loan in each chunk may continue in the next chunk, so they are carried over.
+    """
+
+    carry = None
+    for df_chunk in pd.read_csv(actual_path, chunksize=chunksize, dtype=ACTUAL_DTYPES):
+        if carry is not None:
+            df_chunk = pd.concat([carry, df_chunk], ignore_index=True)
+
+        last_loan = df_chunk["LoanID"].iat[-1]
+        is_last_loan = (df_chunk["LoanID"] == last_loan).to_numpy()
+        carry = df_chunk[is_last_loan]
+        if not is_last_loan.all():
+            yield df_chunk[~is_last_loan]
+
+    if carry is not None and len(carry):
+        yield carry
+
+
+def _iter_partitioned_groups(actual_path, chunksize, n_partitions, spill_dir):
+    """
+    Yield frames of complete loans from an unordered file by hash-partitioning it on LoanID.
+
+    A first pass spills every chunk into one Parquet file per partition, kept open for the whole pass
+    so each chunk adds a row group instead of a file. A second pass reads the partitions back one at
+    a time. Each partition holds roughly 1/n_partitions of the file.
+    """
+
+    if n_partitions is None:
+        n_partitions = max(1, math.ceil(os.path.getsize(actual_path) / (chunksize * _BYTES_PER_ROW)))
+
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmp_dir:
+        writers = {}
+        try:
+            for df_chunk in pd.read_csv(actual_path, chunksize=chunksize, dtype=ACTUAL_DTYPES):
+                partition = df_chunk["LoanID"].to_numpy() % n_partitions
+                for p, df_part in df_chunk.groupby(partition, sort=False):
+                    table = pa.Table.from_pandas(df_part, preserve_index=False)
+                    if p not in writers:
+                        writers[p] = pq.ParquetWriter(os.path.join(tmp_dir, f"part-{p}.parquet"), table.schema)
+                    writers[p].write_table(table)
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        for p in sorted(writers):
+            yield pq.read_table(os.path.join(tmp_dir, f"part-{p}.parquet")).to_pandas()
+
+
+def iter_balance_chunks(
+    actual_path,
+    df_scheduled,
+    chunksize=1_000_000,
+    sorted_by_loan=False,
+    n_partitions=None,
+    spill_dir=None,
+    r_monthly=R_MONTHLY,
+):
+    """
+    Stream balances for an actual repayments file chunk by chunk.
+
+    Every loan's rows end up in exactly one yielded frame, so the balances equal those of
+    'calculate_df_balances_vectorized()' on the whole file. Frames are sorted by LoanID and Month
+    internally, but loans are not globally ordered across frames.
+
+    Args:
+        actual_path (str): CSV shaped like the 'actual_loan_repayments.csv' dataset
+        df_scheduled (DataFrame): Dataframe created from the 'scheduled_loan_repayments.csv' dataset
+        chunksize (int): Number of CSV rows read at a time
+        sorted_by_loan (bool): The file is already grouped by LoanID, so a single pass suffices
+        n_partitions (int): Number of spill partitions for unordered files, estimated from the file size by default
+        spill_dir (str): Directory for the temporary spill files, the system temp directory by default
+        r_monthly (float): Monthly interest rate, defaults to 10% per annum
+
+    Yields:
+        DataFrame: Balances with the same columns as 'calculate_df_balances_vectorized()'.
+
+    """
+
+    df_scheduled_index = df_scheduled.set_index("LoanID")
+
+    if sorted_by_loan:
+        groups = _iter_sorted_groups(actual_path, chunksize)
+    else:
+        groups = _iter_partitioned_groups(actual_path, chunksize, n_partitions, spill_dir)
+
+    for df_group in groups:
+        yield _amortize_chunk(df_scheduled_index, df_group, r_monthly)
+
+
+def write_balances_stream(actual_path, df_scheduled, out_path, **kwargs):
+    """
+    Stream balances for an actual repayments file into a single Parquet file.
+
+    Args:
+        actual_path (str): CSV shaped like the 'actual_loan_repayments.csv' dataset
+        df_scheduled (DataFrame): Dataframe created from the 'scheduled_loan_repayments.csv' dataset
+        out_path (str): Parquet file to write
+        **kwargs: Passed on to 'iter_balance_chunks()'
+
+    Returns:
+        int: Number of balance rows written.
+
+    """
+
+    rows = 0
+    writer = None
+    try:
+        for df_chunk in iter_balance_chunks(actual_path, df_scheduled, **kwargs):
+            if writer is None:
+                table = pa.Table.from_pandas(df_chunk, preserve_index=False)
+                writer = pq.ParquetWriter(out_path, table.schema)
+            else:
+                table = pa.Table.from_pandas(df_chunk, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+            rows += len(df_chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return rows
@@ -0,0 +1,399 @@
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal, assert_series_equal
+
+import Python as py
+
+"""
+Parity tests for the vectorized balance engine and the modules built on it, against 'calculate_df_balances()' and
+the 'question_*' answers on the Task_2 datasets.
+
+"""
+
+# Task_1 has a benchmark module too, so this one is loaded from its file under a name of its own
+_benchmark_spec = importlib.util.spec_from_file_location(
+    "task_2_benchmark", os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark.py")
+)
+benchmark = importlib.util.module_from_spec(_benchmark_spec)
+_benchmark_spec.loader.exec_module(benchmark)
+
+
+@pytest.fixture(scope="module")
+def df_scheduled():
+    return pd.read_csv(py.SCHEDULED_CSV)
+
+
+@pytest.fixture(scope="module")
+def df_actual():
+    return pd.read_csv(py.ACTUAL_CSV)
+
+
+@pytest.fixture(scope="module")
+def df_reference(df_scheduled, df_actual):
+    return py.calculate_df_balances(df_scheduled, df_actual)
+
+
+@pytest.fixture(scope="module")
+def df_balances(df_scheduled, df_actual):
+    return py.calculate_df_balances_vectorized(df_scheduled, df_actual)
+
+
+def test_vectorized_matches_reference(df_reference, df_balances):
+    assert_frame_equal(df_balances, df_reference, check_exact=True)
+
+
+def test_vectorized_clamps_at_zero():
+    # Loan 2 repays more than it owes in month 2 and keeps a zero balance afterwards
+    df_scheduled = pd.DataFrame(
+        {"LoanID": [1, 2], "LoanAmount": [1000.0, 500.0], "ScheduledRepayment": [100.0, 50.0]}
+    )
+    df_actual = pd.DataFrame(
+        {
+            "RepaymentID": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+            "LoanID": [1, 2, 1, 2, 1, 2],
+            "Month": [1, 1, 2, 2, 3, 3],
+            "ActualRepayment": [100.0, 50.0, 100.0, 900.0, 100.0, 50.0],
+        }
+    )
+
+    df_reference = py.calculate_df_balances(df_scheduled, df_actual)
+    df_balances = py.calculate_df_balances_vectorized(df_scheduled, df_actual)
+
+    assert_frame_equal(df_balances, df_reference, check_exact=True)
+    assert df_balances.loc[df_balances["LoanID"] == 2, "LoanBalanceEnd"].tolist() == [454.17, 0.0, 0.0]
+
+
+def test_last_loan_balances(df_balances):
+    df_last = py.last_loan_balances(df_balances)
+    df_expected = df_balances.loc[df_balances["Month"] == 12, ["LoanID", "Month", "LoanBalanceEnd"]]
+
+    assert_frame_equal(df_last, df_expected.reset_index(drop=True), check_exact=True)
+
+
+def test_update_df_balances_continues_from_state(df_scheduled, df_actual, df_balances):
+    df_first, df_state = py.update_df_balances(df_scheduled, df_actual[df_actual["Month"] <= 6], None)
+    df_rest, df_state = py.update_df_balances(df_scheduled, df_actual[df_actual["Month"] > 6], df_state)
+
+    df_incremental = pd.concat([df_first, df_rest]).sort_values(["LoanID", "Month"], kind="mergesort")
+    df_incremental = df_incremental.reset_index(drop=True)
+
+    assert_frame_equal(df_incremental, df_balances, check_exact=True)
+    assert df_state["Month"].eq(12).all()
+
+
+def test_update_df_balances_rejects_stale_months(df_scheduled, df_actual, df_balances):
+    with pytest.raises(ValueError):
+        py.update_df_balances(df_scheduled, df_actual[df_actual["Month"] == 12], py.last_loan_balances(df_balances))
+
+
+def test_shared_rate_columns_match_scalar_rate(df_scheduled, df_actual, df_balances):
+    df_scheduled = df_scheduled.assign(InterestRate=10.0, LoanTerm=24)
+    df_rates = py.calculate_df_balances_vectorized(
+        df_scheduled, df_actual, rate_column="InterestRate", term_column="LoanTerm"
+    )
+
+    assert_frame_equal(df_rates.drop(columns=["InterestRate", "LoanTerm"]), df_balances, check_exact=True)
+
+
+def test_per_loan_rates_and_terms(df_scheduled, df_actual):
+    rng = np.random.default_rng(0)
+    df_scheduled = df_scheduled.assign(
+        InterestRate=np.round(rng.uniform(4, 12, len(df_scheduled)), 2),
+        LoanTerm=rng.choice([6, 12, 24], len(df_scheduled)),
+    )
+    df_rates = py.calculate_df_balances_vectorized(
+        df_scheduled, df_actual, rate_column="InterestRate", term_column="LoanTerm"
+    )
+
+    # Walk every loan month by month, without interest once it is past its term
+    expected = []
+    for _, df_loan in df_rates.groupby("LoanID"):
+        r_monthly = df_loan["InterestRate"].iat[0] / 100 / 12
+        balance = df_loan["LoanAmount"].iat[0]
+        for month, repayment, term in zip(df_loan["Month"], df_loan["ActualRepayment"], df_loan["LoanTerm"]):
+            rate = r_monthly if month <= term else 0.0
+            balance = max(0, (balance + balance * rate) - repayment)
+            expected.append(round(balance, 2))
+
+    np.testing.assert_allclose(df_rates["LoanBalanceEnd"], expected, atol=0.01)
+
+
+def test_interest_stops_past_the_term():
+    loan_ids = np.array([1, 1, 1, 1, 2, 2, 2, 2])
+    repayments = np.array([100.0, 0.0, 0.0, 100.0, 0.0, 0.0, 0.0, 0.0])
+    opening_balances = np.full(8, 1200.0)
+
+    _, end, interest = py.amortize_arrays(loan_ids, repayments, opening_balances, 0.01, np.full(8, 2))
+    np.testing.assert_allclose(interest, [12.0, 11.12, 0, 0, 12.0, 12.12, 0, 0])
+    np.testing.assert_allclose(end[[3, 7]], [1123.12 - 100, 1224.12])
+
+    # Without terms interest accrues every month, like calculate_df_balances()
+    _, end, interest = py.amortize_arrays(loan_ids, repayments, opening_balances, 0.01)
+    assert (interest > 0).all()
+    np.testing.assert_allclose(end[7], 1200.0 * 1.01**4)
+
+
+def test_parallel_matches_vectorized(df_scheduled, df_actual, df_balances):
+    from parallel import calculate_df_balances_parallel
+
+    assert_frame_equal(
+        calculate_df_balances_parallel(df_scheduled, df_actual, n_workers=2), df_balances, check_exact=True
+    )
+
+
+def test_streaming_matches_vectorized(df_scheduled, df_balances, tmp_path):
+    from streaming import iter_balance_chunks
+
+    df_streamed = pd.concat(iter_balance_chunks(py.ACTUAL_CSV, df_scheduled, chunksize=2_000, spill_dir=tmp_path))
+    df_streamed = df_streamed.sort_values(["LoanID", "Month"], kind="mergesort").reset_index(drop=True)
+
+    assert_frame_equal(df_streamed, df_balances, check_exact=True)
+
+
+def test_duckdb_backend_matches_pandas(df_balances, cache_dir):
+    import duckdb_backend as db
+
+    with db.connect() as con:
+        df_duckdb = db.compute_balances("duckdb", con)
+        answers = [db.compute_question(number, "duckdb", con) for number in range(1, 5)]
+
+    # Balances are rounded to cents, so a floating-point difference can flip the last cent.
+    assert_frame_equal(df_duckdb, df_balances, check_dtype=False, check_exact=False, rtol=0, atol=0.011)
+    expected = [db.compute_question(number, "pandas") for number in range(1, 5)]
+    np.testing.assert_allclose(answers, expected, rtol=1e-9)
+
+
+def test_balances_cache_round_trip(df_balances, tmp_path):
+    key = py.balances_cache_key(["scheduled", "actual"])
+    assert py.read_balances_cache(key, tmp_path) is None
+
+    py.write_balances_cache(df_balances, key, tmp_path)
+    assert_frame_equal(py.read_balances_cache(key, tmp_path), df_balances, check_exact=True)
+
+
+def test_write_balances_cache_removes_stale_files(df_balances, tmp_path):
+    (tmp_path / "notes.txt").write_text("kept")
+    py.write_balances_cache(df_balances.head(), py.balances_cache_key(["scheduled", "old actual"]), tmp_path)
+    path = py.write_balances_cache(df_balances, py.balances_cache_key(["scheduled", "actual"]), tmp_path)
+
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(path), "notes.txt"]
+    assert py.read_balances_cache(py.balances_cache_key(["scheduled", "old actual"]), tmp_path) is None
+
+
+def test_load_cached_rebuilds_only_changed_contents(tmp_path, monkeypatch):
+    monkeypatch.setattr(py, "_dataset_cache", {})
+    path = tmp_path / "input.csv"
+    path.write_text("a\n1\n")
+    builds = []
+
+    def build(files):
+        builds.append(files[str(path)])
+        return len(builds)
+
+    assert py._load_cached("test_input", [str(path)], build) == 1
+    assert py._load_cached("test_input", [str(path)], build) == 1
+
+    # Touching the file changes its mtime but not its hash
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert py._load_cached("test_input", [str(path)], build) == 1
+    assert py._dataset_cache["test_input"]["files"][str(path)][0] == stat.st_mtime_ns + 10**9
+
+    path.write_text("a\n2\n")
+    assert py._load_cached("test_input", [str(path)], build) == 2
+    assert builds[0][2] != builds[1][2]
+
+
+def test_datasets_load_lazily_from_the_disk_cache(cache_dir, monkeypatch):
+    assert py._dataset_cache == {}
+    df_balances = py.df_balances
+    assert py.df_balances is df_balances
+    assert set(py._dataset_cache) == {"df_scheduled", "df_actual", "df_balances"}
+
+    # A new process reads the balances back from the Parquet cache instead of amortizing again
+    py.clear_dataset_cache()
+    monkeypatch.setattr(py, "calculate_df_balances_vectorized", None)
+    assert_frame_equal(py.load_balances(), df_balances, check_exact=True)
+    assert "df_actual" not in py._dataset_cache
+
+
+def test_portfolio_metrics_match_questions(df_scheduled, df_balances):
+    metrics = py.PortfolioMetrics(df_balances)
+
+    assert metrics.type_1_default_rate == py.question_1(df_balances)
+    assert metrics.type_2_default_rate == py.question_2(df_scheduled, df_balances)
+    assert metrics.cpr == pytest.approx(py.question_3(df_balances), rel=1e-12)
+    assert py.question_4(df_balances) == 78365.85352799998
+
+
+def test_scenario_grid_default_matches_question_4(df_balances):
+    from scenarios import loan_exposures, scenario_grid
+
+    df_scenarios = scenario_grid(df_balances)
+    assert len(df_scenarios) == 1
+    assert df_scenarios["ExpectedLoss"].iat[0] == pytest.approx(py.question_4(df_balances), rel=1e-12)
+
+    # Re-amortizing under the 10% rate of the balances gives back their month 12 LoanBalanceEnd
+    loan_ids, exposures = loan_exposures(df_balances, annual_rates=[0.1])
+    df_month_12 = df_balances[df_balances["Month"] == 12]
+    np.testing.assert_array_equal(loan_ids, df_month_12["LoanID"])
+    np.testing.assert_array_equal(exposures[0], df_month_12["LoanBalanceEnd"])
+
+
+def test_prepayment_portfolio_cpr_matches_question_3(df_balances):
+    from prepayment import PrepaymentAnalytics, default_groupings
+
+    analytics = PrepaymentAnalytics(df_balances)
+    assert analytics.window_cpr("Portfolio", 1, 12).iat[0] == pytest.approx(py.question_3(df_balances), rel=1e-12)
+
+    # Every loan size bucket on its own matches question_3 on its loans
+    sizes = default_groupings(df_balances)["LoanSize"]
+    expected = pd.Series(
+        [py.question_3(df_balances[sizes == size]) for size in analytics.groups["LoanSize"]],
+        index=analytics.groups["LoanSize"],
+        name="CPR",
+    )
+    assert_series_equal(analytics.window_cpr("LoanSize", 1, 12), expected, rtol=1e-12)
+
+    # Rolling windows are ratios of the prefix products
+    smm = analytics.smm("Portfolio").to_numpy()[0]
+    rolling = analytics.rolling_cpr("Portfolio", 3)
+    expected_cpr = (1 - (1 - (np.prod(1 + smm[3:6]) ** (1 / 3) - 1)) ** 12) * 100
+    assert rolling[6].iat[0] == pytest.approx(expected_cpr, rel=1e-12)
+
+
+def test_simulation_is_deterministic_and_unbiased(df_balances):
+    from simulation import simulate_portfolio
+
+    losses, df_percentiles = simulate_portfolio(df_balances, n_paths=4_000, seed=1, max_block_elements=2**20)
+    sharded, _ = simulate_portfolio(df_balances, n_paths=4_000, seed=1, max_block_elements=2**20, n_workers=2)
+
+    np.testing.assert_array_equal(losses, sharded)
+    assert losses.mean() == pytest.approx(py.question_4(df_balances), rel=0.02)
+    assert df_percentiles["VaR"].is_monotonic_increasing
+
+    # Bucketing is an opt-in approximation that keeps the expected loss
+    bucketed, _ = simulate_portfolio(df_balances, n_paths=4_000, seed=1, n_buckets=64)
+    assert bucketed.mean() == pytest.approx(py.question_4(df_balances), rel=0.02)
+
+
+def test_default_index_matches_questions(df_scheduled, df_balances, tmp_path):
+    from default_index import DefaultIndex
+
+    index = DefaultIndex.from_balances(df_balances, "key")
+    index = DefaultIndex.read(index.write(str(tmp_path / "default_index.parquet")))
+    assert index.balances_key == "key"
+    assert index.loan_ids.dtype == np.int16
+
+    assert 100 * len(index.filter(type_1=True)) / len(index) == py.question_1(df_balances)
+    assert 100 * len(index.filter(type_2=True)) / len(index) == py.question_2(df_scheduled, df_balances)
+
+    df_missed = df_balances[df_balances["ActualRepayment"] < df_balances["ScheduledRepayment"]]
+    first_missed = df_missed.groupby("LoanID")["Month"].min()
+    df_lookup = index.lookup(first_missed.index)
+    np.testing.assert_array_equal(df_lookup["FirstType1DefaultMonth"], first_missed)
+    assert index.get(-1) is None
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """
+    Point the balances cache at a temporary directory, with an empty in-memory dataset cache.
+    """
+
+    monkeypatch.setattr(py, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(py, "_dataset_cache", {})
+    return py.CACHE_DIR
+
+
+def test_default_index_is_rebuilt_for_other_balances(cache_dir, tmp_path):
+    from default_index import DefaultIndex, load_default_index, read_balances_key
+
+    path = str(tmp_path / "default_index.parquet")
+    DefaultIndex.from_balances(py.load_balances().head(24), "stale key").write(path)
+
+    index = load_default_index(path)
+    assert read_balances_key(path) == index.balances_key == py.current_balances_cache_key()
+    assert len(index) == py.load_balances()["LoanID"].nunique()
+    assert os.listdir(cache_dir) == [f"balances-{index.balances_key}.parquet"]
+
+
+def test_compact_schema_gives_identical_answers(df_scheduled, df_balances):
+    import schema
+
+    df_scheduled_compact = schema.read_scheduled()
+    df_compact = schema.apply_schema(
+        py.calculate_df_balances_vectorized(df_scheduled_compact, schema.read_actual()), schema.BALANCES_SCHEMA
+    )
+
+    assert df_compact.dtypes.astype(str).to_dict() == {column: schema.BALANCES_SCHEMA[column] for column in df_compact}
+    assert_frame_equal(df_compact, df_balances, check_dtype=False, check_exact=True)
+    assert py.question_1(df_compact) == py.question_1(df_balances)
+    assert py.question_2(df_scheduled_compact, df_compact) == py.question_2(df_scheduled, df_balances)
+    assert py.question_3(df_compact) == py.question_3(df_balances)
+    assert py.question_4(df_compact) == py.question_4(df_balances)
+
+    # Cents are exact for the 2 decimal amounts and convert back to the same floats
+    df_cents = schema.apply_schema(df_compact, schema.BALANCES_SCHEMA, amounts="cents")
+    for column in schema.AMOUNT_COLUMNS:
+        assert df_cents[column].dtype == "int32"
+        assert_series_equal(schema.from_cents(df_cents[column]), df_balances[column], check_exact=True)
+
+    report = schema.memory_report({"default": df_balances, "compact": df_compact, "cents": df_cents})
+    assert list(report.columns) == ["Frame", "Rows", "Bytes", "BytesPerRow"]
+    assert (report["Rows"] == len(df_balances)).all()
+    assert report["Bytes"].is_monotonic_decreasing and report["Bytes"].is_unique
+
+
+def test_compact_schema_rejects_lossy_casts():
+    import schema
+
+    with pytest.raises(ValueError, match="more than 2 decimals"):
+        schema.to_cents(pd.Series([1.005], name="LoanAmount"))
+    with pytest.raises(ValueError, match="does not fit in int16"):
+        schema.apply_schema(pd.DataFrame({"Month": [40_000]}), schema.ACTUAL_SCHEMA)
+    with pytest.raises(ValueError, match="non-integer"):
+        schema.apply_schema(pd.DataFrame({"LoanID": [1.5]}), schema.SCHEDULED_SCHEMA)
+
+
+def test_generated_portfolio_is_seeded_and_shaped_like_the_csvs(df_scheduled, df_actual):
+    df_generated_scheduled, df_generated_actual = benchmark.generate_portfolio(200, seed=1)
+    assert_frame_equal(benchmark.generate_portfolio(200, seed=1)[1], df_generated_actual, check_exact=True)
+    assert not benchmark.generate_portfolio(200, seed=2)[1].equals(df_generated_actual)
+
+    assert df_generated_scheduled.dtypes.to_dict() == df_scheduled.dtypes.to_dict()
+    assert df_generated_actual.dtypes.to_dict() == df_actual.dtypes.to_dict()
+    assert len(df_generated_actual) == 200 * 12
+    assert df_generated_actual.groupby("LoanID")["Month"].nunique().eq(12).all()
+
+    assert_frame_equal(
+        py.calculate_df_balances_vectorized(df_generated_scheduled, df_generated_actual),
+        py.calculate_df_balances(df_generated_scheduled, df_generated_actual),
+        check_exact=True,
+    )
+
+
+def test_benchmark_records_every_stage(tmp_path):
+    import json
+
+    results = benchmark.run_benchmark(50, include_reference=True)
+    assert [result["stage"] for result in results] == [
+        "generate",
+        "calculate_df_balances",
+        "calculate_df_balances_vectorized",
+        "question_1",
+        "question_2",
+        "question_3",
+        "question_4",
+        "portfolio_metrics",
+    ]
+    assert all(result["n_loans"] == 50 and result["n_rows"] == 600 for result in results)
+    assert all(result["seconds"] >= 0 and result["peak_bytes"] > 0 for result in results)
+
+    benchmark.write_results(results, str(tmp_path / "results.json"))
+    with open(tmp_path / "results.json") as f:
+        assert json.load(f)["results"] == results